@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks of the SEDAC GPW v3 conversion, downsampling and aggregation on synthetic grids
+
+Every stage is run in a separate process on synthetic SEDAC shaped grids (see synthetic.py) of the chosen resolutions,
+its wall and CPU time and the peak memory (max RSS) of the process are measured. Every stage is run several times
+(--repeats) and the best run is kept, a stage whose process dies (e.g. out of memory) or runs longer than --timeout is
+recorded as failed. The results are appended to a json lines history file, so runs can be compared over time - with
+--compare the last run is checked against the previous one (or the one given with --baseline) and the script fails if
+any stage failed or got slower than the allowed regression.
+
+Usage:
+    python bench_sedac.py --resolutions 15m 5m 2.5m
+    python bench_sedac.py --compare --max-regression 0.2
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import datetime
+import platform
+import subprocess
+import collections
+import multiprocessing
+import numpy
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import sedac_ascii
+import downsampling
+import zonal
+import grid_cache
+import instrumentation
+import convert_ntlnbd
+import convert_pcount
+import synthetic
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_FILE = os.path.join(BENCH_DIR, 'results', 'history.jsonl')
+WORK_DIR = os.path.join(BENCH_DIR, 'work')
+# number of runs of every stage, the best run is recorded (the stages that take milliseconds are noisy)
+REPEATS = 3
+# seconds a stage can run before it is stopped and recorded as failed
+STAGE_TIMEOUT = 3600
+# seconds between the checks of the stage process while waiting for its result
+POLL_INTERVAL = 1.0
+# wall time differences below this (in seconds) are never regressions
+MIN_WALL_DIFFERENCE = 0.05
+
+# paths of the inputs and outputs of the stages of one resolution
+BenchFiles = collections.namedtuple('BenchFiles', 'glbndsAscii pcountAscii outDir cacheDir')
+
+def log(message):
+    sys.stdout.write(message)
+
+# ****** the stages: setup(files) is not measured, run(state) is measured and returns the number of processed cells
+# (None if the stage has nothing to do at the resolution)
+
+def setupNothing(files):
+    return files
+
+def runHeaderCheck(files):
+    header = sedac_ascii.readAsciiHeader(files.glbndsAscii)
+    sedac_ascii.readAsciiHeader(files.pcountAscii)
+    return header.ncols*header.nrows
+
+def runParse(files):
+    header, glbnds = sedac_ascii.loadAsciiFile(files.glbndsAscii, 'int32')
+    header, pcount = sedac_ascii.loadAsciiFile(files.pcountAscii, 'float32')
+    return glbnds.size + pcount.size
+
+def runCreateNcFile(files):
+    convert_ntlnbd.convertSEDACglbndsAscii2nc(files.glbndsAscii, os.path.join(files.outDir, 'glbnds'), coarseGrids=[], gridCacheDir=None)
+    convert_pcount.convertSEDACpcountAscii2nc(files.pcountAscii, os.path.join(files.outDir, 'pcount'), coarseGrids=[], gridCacheDir=None)
+    header = sedac_ascii.readAsciiHeader(files.glbndsAscii)
+    return 2*header.ncols*header.nrows
+
+def setupDownsampling(files):
+    header, glbnds = sedac_ascii.loadAsciiFile(files.glbndsAscii, 'int32')
+    header, pcount = sedac_ascii.loadAsciiFile(files.pcountAscii, 'float32')
+    return header, glbnds, pcount
+
+def runHalfDegreeDownsampling(state):
+    header, glbnds, pcount = state
+    dv = int(round(0.5*header.ncols/360.0))
+    # the 30' grid is already a 1/2° grid
+    if dv<=1: return None
+    downsampling.blockMajority(glbnds, dv, overrides=convert_ntlnbd.SEA_THRESHOLD_OVERRIDES)
+    downsampling.blockSum(pcount, dv)
+    return glbnds.size + pcount.size
+
+def runTotalPopulation(files):
+    # same as getTotalPopulation of the test scripts, the grids are opened through the grid cache
+    glbnds, lats, lons = grid_cache.openNcGrid(os.path.join(files.outDir, 'glbnds_25.nc'), 'glbnds', files.cacheDir)
+    pcount, lats, lons = grid_cache.openNcGrid(os.path.join(files.outDir, 'pcount_25.nc'), 'pcount', files.cacheDir)
+    zonal.zonalSums(glbnds, pcount, int(glbnds.max())+1)
+    return glbnds.size
+
+# (name, setup, run) of the stages in the order they are run (later stages use the results of the earlier ones)
+STAGES = [('header check', setupNothing, runHeaderCheck),
+          ('parse', setupNothing, runParse),
+          ('createNcFile', setupNothing, runCreateNcFile),
+          ('createHalfDegreeNcFile', setupDownsampling, runHalfDegreeDownsampling),
+          ('getTotalPopulation', setupNothing, runTotalPopulation),
+          ('getTotalPopulation (cached)', setupNothing, runTotalPopulation)]
+
+def measureStage(setup, run, files, queue):
+    # runs in a separate process, so the peak memory belongs to the stage only
+    try:
+        state = setup(files)
+        wall, cpu = time.time(), instrumentation.getCpuTime()
+        cells = run(state)
+        wall, cpu = time.time()-wall, instrumentation.getCpuTime()-cpu
+        if cells is None: queue.put({'skipped': True})
+        else: queue.put({'wall': wall, 'cpu': cpu, 'peakRssMB': instrumentation.getPeakRss(), 'cells': cells, 'cellsPerSecond': cells/wall if 0<wall else None})
+    except Exception as e:
+        queue.put({'error': repr(e)})
+
+def runStage(setup, run, files, timeout=STAGE_TIMEOUT):
+    # result of one run of a stage in a separate process, an error if the process dies (e.g. out of memory) or times out
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measureStage, args=(setup, run, files, queue))
+    process.start()
+    deadline = time.time()+timeout
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=POLL_INTERVAL)
+        except Empty:
+            if not process.is_alive():
+                # the result may have arrived right before the process exited
+                try:
+                    result = queue.get(timeout=POLL_INTERVAL)
+                except Empty:
+                    result = {'error': 'stage process died with exit code {0}'.format(process.exitcode)}
+            elif deadline<time.time():
+                process.terminate()
+                result = {'error': 'stage timed out after {0}s'.format(timeout)}
+    process.join()
+    return result
+
+def repeatStage(setup, run, files, repeats=REPEATS, timeout=STAGE_TIMEOUT):
+    # best wall and CPU time and peak memory of several runs of a stage (the wall times of every run are kept too),
+    # the stage failed if any of its runs failed
+    results = list()
+    for i in range(repeats):
+        result = runStage(setup, run, files, timeout)
+        if 'wall' not in result: return result
+        results.append(result)
+    best = min(results, key=lambda result: result['wall'])
+    return dict(best, cpu=min(result['cpu'] for result in results), peakRssMB=min(result['peakRssMB'] for result in results),
+                walls=[result['wall'] for result in results], repeats=repeats)
+
+def getCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR).decode('ascii').strip()
+    except Exception:
+        return None
+
+def runBenchmarks(resolutions, workDir=WORK_DIR, historyFile=HISTORY_FILE, seed=0, repeats=REPEATS, timeout=STAGE_TIMEOUT):
+    # runs every stage on every resolution repeatedly and appends the best results to the history file
+    run = {'run': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), 'commit': getCommit(), 'host': socket.gethostname(),
+           'python': platform.python_version(), 'numpy': numpy.__version__}
+    records = list()
+    for resolution in resolutions:
+        log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   creating synthetic '+resolution+' grids...')
+        glbndsAscii, pcountAscii = synthetic.createSyntheticGrids(workDir, resolution, seed)
+        log('.\n')
+        outDir = os.path.join(os.path.dirname(glbndsAscii), 'out')
+        if os.path.isdir(outDir): shutil.rmtree(outDir)
+        os.makedirs(outDir)
+        files = BenchFiles(glbndsAscii=glbndsAscii, pcountAscii=pcountAscii, outDir=outDir, cacheDir=os.path.join(outDir, 'cache'))
+        for name, setup, stageRun in STAGES:
+            result = repeatStage(setup, stageRun, files, repeats, timeout)
+            record = dict(run, resolution=resolution, stage=name, **result)
+            records.append(record)
+            if 'error' in result: log('    {0:<28} {1:>6}  failed: {2}\n'.format(name, resolution, result['error']))
+            elif 'skipped' in result: log('    {0:<28} {1:>6}  skipped (nothing to do at this resolution)\n'.format(name, resolution))
+            else: log('    {0:<28} {1:>6}  wall {2:8.3f}s  cpu {3:8.3f}s  peak {4:8.1f}MB  {5:10.3g} cells/s\n'.format(
+                      name, resolution, result['wall'], result['cpu'], result['peakRssMB'], result['cellsPerSecond'] or 0))
+    if not os.path.isdir(os.path.dirname(historyFile)): os.makedirs(os.path.dirname(historyFile))
+    with open(historyFile, 'a') as f:
+        for record in records: f.write(json.dumps(record, sort_keys=True)+'\n')
+    return records
+
+def compareRuns(historyFile=HISTORY_FILE, baseline=None, maxRegression=0.2, minWallDifference=MIN_WALL_DIFFERENCE):
+    # Compares the best wall time and peak memory of the last run with the baseline run (the previous one by default),
+    # returns False if any stage failed, or got slower or bigger than the allowed regression (wall time differences
+    # below minWallDifference seconds are noise)
+    with open(historyFile, 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    runs = sorted(set(record['run'] for record in records))
+    if len(runs)<2 and baseline is None: raise Exception('Not enough runs', 'At least two runs are needed for the comparison.')
+    last = runs[-1]
+    if baseline is None: baseline = runs[-2]
+    base = dict(((r['resolution'], r['stage']), r) for r in records if baseline==r['run'] and 'wall' in r)
+    ok = True
+    log('comparing {0} with {1}\n'.format(last, baseline))
+    for r in records:
+        if last!=r['run'] or (r['resolution'], r['stage']) not in base: continue
+        if 'error' in r:
+            log('    {0:<28} {1:>6}  failed\n'.format(r['stage'], r['resolution']))
+            ok = False
+            continue
+        if 'skipped' in r: continue
+        b = base[(r['resolution'], r['stage'])]
+        wallRatio = r['wall']/b['wall'] if 0<b['wall'] else 1.0
+        memRatio = r['peakRssMB']/b['peakRssMB'] if 0<b['peakRssMB'] else 1.0
+        regression = (1+maxRegression<wallRatio and minWallDifference<r['wall']-b['wall']) or 1+maxRegression<memRatio
+        ok = ok and not regression
+        log('    {0:<28} {1:>6}  wall {2:6.2f}x  peak {3:6.2f}x{4}\n'.format(r['stage'], r['resolution'], wallRatio, memRatio, '  REGRESSION' if regression else ''))
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of the SEDAC GPW v3 scripts on synthetic grids.')
+    parser.add_argument('--resolutions', nargs='*', default=['15m', '5m', '2.5m'], choices=list(synthetic.RESOLUTIONS.keys()),
+                        help='resolutions of the synthetic grids (default: 15m 5m 2.5m, 30s needs several GB of disk and a lot of time)')
+    parser.add_argument('--work', default=WORK_DIR, help='folder of the synthetic grids and the outputs')
+    parser.add_argument('--history', default=HISTORY_FILE, help='json lines file of the results')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic grids')
+    parser.add_argument('--compare', action='store_true', help='compare the last run with the baseline instead of running the benchmarks')
+    parser.add_argument('--baseline', default=None, help='run id of the baseline (default: the previous run)')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='allowed relative slowdown / memory growth (default: 0.2)')
+    parser.add_argument('--repeats', type=int, default=REPEATS, help='runs of every stage, the best one is recorded (default: {0})'.format(REPEATS))
+    parser.add_argument('--timeout', type=int, default=STAGE_TIMEOUT, help='seconds a stage can run before it fails (default: {0})'.format(STAGE_TIMEOUT))
+    args = parser.parse_args()
+    if args.compare: sys.exit(0 if compareRuns(args.history, args.baseline, args.max_regression) else 1)
+    runBenchmarks(args.resolutions, args.work, args.history, args.seed, args.repeats, args.timeout)
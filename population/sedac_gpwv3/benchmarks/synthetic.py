@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+'''
+Synthetic SEDAC GPW v3 shaped ascii grids for the benchmarks
+
+The grids have the extent and header of the GPW v3 grids (xllcorner -180, yllcorner -58, top at 85°N) at any
+resolution. Land is generated from a smooth random field, the countries are the Voronoi cells of random centers
+on a 30' grid with noisy borders and coasts at the target resolution, and the population counts are lognormal
+on land (scaled with the cell area, so the totals are similar at every resolution).
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import gzip
+import collections
+import numpy
+
+# resolution name -> number of cells per degree
+RESOLUTIONS = collections.OrderedDict([('30m', 2), ('15m', 4), ('5m', 12), ('2.5m', 24), ('30s', 120)])
+# extent of the GPW v3 grids
+TOP, BOTTOM = 85, -58
+NODATA_value = -9999
+# the country map is created on a 30' grid
+COARSE_CELLS_PER_DEGREE = 2
+COUNTRIES = 230
+
+def createCountryMap(seed, countries=COUNTRIES):
+    # Returns the [lat x lon] country id map (2..countries+1, NODATA on sea) on the 30' grid
+    rng = numpy.random.RandomState(seed)
+    cpd = COARSE_CELLS_PER_DEGREE
+    lats = numpy.radians(TOP - (numpy.arange((TOP-BOTTOM)*cpd)+0.5)/cpd)
+    lons = numpy.radians(-180 + (numpy.arange(360*cpd)+0.5)/cpd)
+    # land is where the sum of a few random waves is high (~30% of the cells)
+    field = numpy.zeros([lats.size, lons.size])
+    for k in range(12):
+        fx, fy = rng.randint(1, 6), rng.randint(1, 6)
+        field += rng.rand() * numpy.outer(numpy.cos(fy*lats + 2*numpy.pi*rng.rand()), numpy.sin(fx*lons + 2*numpy.pi*rng.rand()))
+    land = numpy.percentile(field, 70)<field
+    # the countries are the Voronoi cells of random land cells
+    landCells = numpy.flatnonzero(land)
+    centers = landCells[rng.choice(landCells.size, countries, replace=False)]
+    centerLat, centerLon = lats[centers//lons.size], lons[centers%lons.size]
+    ids = numpy.empty(land.shape, dtype='int32')
+    ids[:,:] = NODATA_value
+    dLon = numpy.angle(numpy.exp(1j*(lons[:,numpy.newaxis]-centerLon)))
+    for i in range(lats.size):
+        # squared distance on the sphere (equirectangular approximation) from every center
+        dist = (dLon*numpy.cos(lats[i]))**2 + (lats[i]-centerLat)**2
+        nearest = 2 + numpy.argmin(dist, axis=1)
+        ids[i,land[i,:]] = nearest[land[i,:]]
+    return ids
+
+def iterSyntheticBands(countryMap, cellsPerDegree, seed):
+    # Yields (firstRow, ids, pcount) tuples of one degree high bands of the grids at the target resolution
+    # the country of a cell is taken from a randomly shifted position of the 30' map (noisy borders and coasts)
+    factor = float(cellsPerDegree)/COARSE_CELLS_PER_DEGREE
+    ncols = 360*cellsPerDegree
+    cols = numpy.arange(ncols)
+    for degree in range(TOP-BOTTOM):
+        rng = numpy.random.RandomState([seed, degree])
+        rows = numpy.arange(degree*cellsPerDegree, (degree+1)*cellsPerDegree)
+        shift = max(1.0, factor)
+        rowShift = rng.uniform(-shift/2, shift/2, [rows.size, ncols])
+        colShift = rng.uniform(-shift/2, shift/2, [rows.size, ncols])
+        coarseRows = numpy.clip(((rows[:,numpy.newaxis]+0.5+rowShift)/factor).astype(int), 0, countryMap.shape[0]-1)
+        coarseCols = (((cols[numpy.newaxis,:]+0.5+colShift)/factor).astype(int)) % countryMap.shape[1]
+        ids = countryMap[coarseRows, coarseCols]
+        pcount = rng.lognormal(3.0, 2.0, ids.shape) * (24.0/cellsPerDegree)**2
+        pcount = numpy.round(pcount, 3)
+        pcount[ids==NODATA_value] = NODATA_value
+        yield degree*cellsPerDegree, ids, pcount
+
+def writeHeader(f, cellsPerDegree):
+    f.write('ncols         {0}\n'.format(360*cellsPerDegree).encode('ascii'))
+    f.write('nrows         {0}\n'.format((TOP-BOTTOM)*cellsPerDegree).encode('ascii'))
+    f.write('xllcorner     -180\n'.encode('ascii'))
+    f.write('yllcorner     {0}\n'.format(BOTTOM).encode('ascii'))
+    f.write('cellsize      {0:.12g}\n'.format(1.0/cellsPerDegree).encode('ascii'))
+    f.write('NODATA_value  {0}\n'.format(NODATA_value).encode('ascii'))
+
+def createSyntheticGrids(workDir, resolution, seed=0):
+    # Writes the glbnds.asc.gz and glp00ag.asc.gz files of a resolution into workDir/<resolution>_<seed>,
+    # (if they don't exist yet) and returns their names
+    cellsPerDegree = RESOLUTIONS[resolution]
+    gridDir = os.path.join(workDir, '{0}_{1}'.format(resolution, seed))
+    glbndsFile = os.path.join(gridDir, 'glbnds.asc.gz')
+    pcountFile = os.path.join(gridDir, 'glp00ag.asc.gz')
+    if os.path.exists(glbndsFile) and os.path.exists(pcountFile): return glbndsFile, pcountFile
+    if not os.path.isdir(gridDir): os.makedirs(gridDir)
+    countryMap = createCountryMap(seed)
+    with gzip.open(glbndsFile+'.tmp', 'wb', compresslevel=1) as fids:
+        with gzip.open(pcountFile+'.tmp', 'wb', compresslevel=1) as fpop:
+            writeHeader(fids, cellsPerDegree)
+            writeHeader(fpop, cellsPerDegree)
+            for firstRow, ids, pcount in iterSyntheticBands(countryMap, cellsPerDegree, seed):
+                numpy.savetxt(fids, ids, fmt='%d')
+                numpy.savetxt(fpop, pcount, fmt='%.12g')
+    os.rename(glbndsFile+'.tmp', glbndsFile)
+    os.rename(pcountFile+'.tmp', pcountFile)
+    return glbndsFile, pcountFile
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+'''
+Population and area weighted regional aggregation of gridded climate time series (e.g. heating-degree-days)
+
+The (time, lat, lon) netCDF variable has to be co-registered with the SEDAC glbnds/pcount grids (glbnds_half, glbnds_25).
+It's read in chunks of time steps, so the whole cube is never loaded, and every chunk is reduced to regional means
+with the cached sparse weight indexes (see weight_index.py). The number of time steps of a chunk is chosen so that
+the chunk and the gathered cells fit into the memory budget (SEDAC_MEMORY_BUDGET environment variable in MB).
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import collections
+import netCDF4
+import numpy
+import grid_cache
+import sedac_nc
+import weight_index
+import instrumentation
+
+# times: time values of the variable (datetime like objects if the time variable has units), populationWeighted and
+# areaWeighted: [time x regions] arrays of the regional means
+RegionalTimeSeries = collections.namedtuple('RegionalTimeSeries', 'times populationWeighted areaWeighted')
+
+def getTimeChunk(gridCells, indexCells, itemSize, memoryBudget=grid_cache.MEMORY_BUDGET):
+    # number of time steps read at once: a time step takes the values and the mask of the grid, and the copies of the
+    # values of the index cells (the gathered values in the original dtype and in float64, their mask and unmasked weights)
+    bytesPerStep = gridCells*(itemSize+1) + indexCells*(itemSize+8+1+8)
+    return int(max(1, memoryBudget//bytesPerStep))
+
+def aggregateNcTimeSeries(ncFile, var, glbndsFile, pcountFile, mapping, size, timeChunk=None, cacheDir=grid_cache.GRID_CACHE_DIR, memoryBudget=grid_cache.MEMORY_BUDGET):
+    # Calculates the population and area weighted means of a (time, lat, lon) variable in every region
+    # mapping assigns a region index to every country id (negative if the country doesn't belong to any region)
+    # and size is the number of regions - use numpy.arange(maxid+1) and maxid+1 for country level results
+    # (timeChunk is the number of time steps read at once, by default it's derived from the memory budget)
+    # reading the chunks and reducing them to regional means are measured as separate stages
+    read = instrumentation.Stage(var+'/read')
+    reduce = instrumentation.Stage(var+'/reduce')
+    with instrumentation.stage(var+'/aggregate') as total:
+        with instrumentation.stage(var+'/weights'):
+            popIndex = weight_index.getWeightIndex(glbndsFile, pcountFile, mapping, size, cacheDir)
+        nc = netCDF4.Dataset(ncFile, 'r')
+        try:
+            ncVar = nc.variables[var]
+            if 3!=len(ncVar.dimensions): raise Exception('Invalid variable', var+' must have (time, lat, lon) dimensions.')
+            timeDim, latDim, lonDim = ncVar.dimensions
+            lats = nc.variables[latDim][:]
+            lons = nc.variables[lonDim][:]
+            # check if the variable is co-registered with the SEDAC grids (latitudes can be in increasing order)
+            sedacLats, sedacLons = sedac_nc.loadGridCoordinates(glbndsFile)
+            flipLat = 1<lats.size and lats[0]<lats[-1]
+            if flipLat: lats = lats[::-1]
+            if lats.shape!=sedacLats.shape or not numpy.allclose(lats, sedacLats): raise Exception('Different lat coordinates!')
+            if lons.shape!=sedacLons.shape or not numpy.allclose(lons, sedacLons): raise Exception('Different lon coordinates!')
+            areaIndex = weight_index.getAreaWeightIndex(popIndex, sedacLats)
+            # reading and aggregating the variable chunk by chunk
+            ntime = ncVar.shape[0]
+            if timeChunk is None: timeChunk = getTimeChunk(lats.size*lons.size, popIndex.cells.size, ncVar.dtype.itemsize, memoryBudget)
+            populationWeighted = numpy.empty([ntime, size])
+            areaWeighted = numpy.empty([ntime, size])
+            for t0 in range(0, ntime, timeChunk):
+                with read:
+                    chunk = numpy.ma.asarray(ncVar[t0:t0+timeChunk,:,:])
+                    if flipLat: chunk = chunk[:,::-1,:]
+                read.count(cells=chunk.size, bytesRead=chunk.nbytes)
+                with reduce:
+                    # the two indexes have the same cells, so the cells are gathered once
+                    values, valid = weight_index.gatherCells(popIndex, chunk)
+                    del chunk
+                    populationWeighted[t0:t0+values.shape[1],:] = weight_index.reduceCells(popIndex, values, valid).T
+                    areaWeighted[t0:t0+values.shape[1],:] = weight_index.reduceCells(areaIndex, values, valid).T
+                reduce.count(cells=values.shape[1]*lats.size*lons.size)
+            times = getTimes(nc, timeDim, ntime)
+        finally:
+            nc.close()
+        total.count(cells=read.cells, bytesRead=read.bytesRead)
+        for s in (read, reduce):
+            if s.calls: s.report()
+    return RegionalTimeSeries(times=times, populationWeighted=populationWeighted, areaWeighted=areaWeighted)
+
+def getTimes(nc, timeDim, ntime):
+    # time values as dates if the time coordinate variable has units, else as they are (or indexes if there's no time variable)
+    if timeDim not in nc.variables: return numpy.arange(ntime)
+    timeVar = nc.variables[timeDim]
+    if 'units' not in timeVar.ncattrs(): return timeVar[:]
+    calendar = timeVar.getncattr('calendar') if 'calendar' in timeVar.ncattrs() else 'standard'
+    return netCDF4.num2date(timeVar[:], timeVar.units, calendar)
+
+def writeRegionalTimeSeries(tsvFile, times, regionNames, values):
+    # writes a [time x regions] table to a tsv file
+    with open(tsvFile, 'w') as f:
+        f.write('time\t'+'\t'.join(regionNames)+'\n')
+        for i in range(len(times)):
+            f.write(str(times[i])+'\t'+'\t'.join('{0}'.format(v) for v in values[i])+'\n')
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+'''
+Batch conversion of SEDAC GPW v3 ascii files into netCDF format
+
+Converts the national boundary grid and any number of population count and density grids (e.g. several epochs)
+in parallel in a process pool. A manifest of the content hashes of the inputs, the parameters and the code is kept
+in the results folder, and conversions whose inputs haven't changed since the last run are skipped.
+
+Usage:
+    python convert_batch.py --glbnds gl_gpwv3_ntlbndid_ascii_25/glbnds.asc.gz
+                            --pcount gl_gpwv3_pcount_00_ascii_25/glp00ag.asc.gz gl_gpwv3_pcount_90_ascii_25/glp90ag.asc.gz
+                            --results results
+The 2000 epoch of a grid (or the latest one without 2000) is named after the grid (results/glbnds, results/pcount,
+results/pdens - the names the tests and grid_store.py read), the other epochs after the grid and the epoch
+(results/pcount90, results/pdens95 ...), an input given as name=file is written to the results folder with the given
+name (e.g. pcount95=glp95ag.asc.gz). Two inputs written to the same file are rejected. The inputs are hashed only when
+their size or modification time has changed since the last run.
+With --epochs the population count epochs are stacked into (year, lat, lon) grids as well (results/pcount_epochs).
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import re
+import sys
+import json
+import datetime
+import argparse
+import collections
+import traceback
+import multiprocessing
+import hashing
+import grid_cache
+import convert_ntlnbd
+import convert_pcount
+
+# pcountAsciiGzFile: population count file of the population shares of the glbnds jobs (None if not needed)
+# the epochs jobs have a tuple of ascii files and a tuple of years
+ConversionJob = collections.namedtuple('ConversionJob', 'kind asciiGzFile ncFile year coarseGrids pcountAsciiGzFile')
+
+MANIFEST_FILE = 'manifest.json'
+# source files whose changes invalidate the earlier results
+CODE_FILES = ['convert_ntlnbd.py', 'convert_pcount.py', 'sedac_ascii.py', 'sedac_nc.py', 'downsampling.py', 'grid_cache.py', 'country_shares.py']
+
+def log(message):
+    sys.stdout.write(message)
+
+def getEpochYear(asciiGzFile):
+    # year of a GPW v3 population grid from its file name (e.g. glp00ag.asc.gz -> 2000, glds90ag.asc.gz -> 1990)
+    match = re.match(r'gl(?:p|ds)(\d\d)', os.path.basename(asciiGzFile))
+    if match is None: return None
+    yy = int(match.group(1))
+    return 1900+yy if 50<=yy else 2000+yy
+
+def createJobs(kind, inputs, resultsDir, coarseGrids, pcountAsciiGzFile=None):
+    items = [item.rpartition('=') for item in inputs]
+    years = [getEpochYear(asciiGzFile) for name, sep, asciiGzFile in items]
+    if 'glbnds'!=kind and None in years: raise Exception('Invalid file name', 'Cannot get the epoch of '+items[years.index(None)][2]+'.')
+    # the 2000 epoch (or the latest one without 2000) gets the name of the grid, the other epochs are named after their year too
+    unnamed = [year for (name, sep, asciiGzFile), year in zip(items, years) if not sep]
+    mainYear = None if 'glbnds'==kind or not unnamed else 2000 if 2000 in unnamed else max(unnamed)
+    jobs = list()
+    for (name, sep, asciiGzFile), year in zip(items, years):
+        if not sep: name = kind if 'glbnds'==kind or mainYear==year else kind+'{0:02d}'.format(year%100)
+        jobs.append(ConversionJob(kind=kind, asciiGzFile=asciiGzFile, ncFile=os.path.join(resultsDir, name), year=year, coarseGrids=coarseGrids,
+                                  pcountAsciiGzFile=pcountAsciiGzFile if 'glbnds'==kind else None))
+    return jobs
+
+def checkJobs(jobs):
+    # the jobs must write different files (e.g. two glbnds files or two files of the same epoch would overwrite each other)
+    ncFiles = dict()
+    for job in jobs:
+        if job.ncFile in ncFiles: raise Exception('Invalid arguments', ' '.join(getInputFiles(ncFiles[job.ncFile]))+' and '+' '.join(getInputFiles(job))+
+                                                  ' would both be written to '+job.ncFile+', name one of them (name=file).')
+        ncFiles[job.ncFile] = job
+
+def createEpochsJob(inputs, resultsDir, coarseGrids, name='pcount_epochs'):
+    # one job that stacks the population count files of every epoch
+    epochs = sorted((getEpochYear(asciiGzFile), asciiGzFile) for asciiGzFile in (item.rpartition('=')[2] for item in inputs))
+    if None in [year for year, asciiGzFile in epochs]: raise Exception('Invalid file name', 'Cannot get the epoch of every population count file.')
+    return ConversionJob(kind='epochs', asciiGzFile=tuple(f for year, f in epochs), ncFile=os.path.join(resultsDir, name),
+                         year=tuple(year for year, f in epochs), coarseGrids=coarseGrids, pcountAsciiGzFile=None)
+
+def getInputFiles(job):
+    return list(job.asciiGzFile) if 'epochs'==job.kind else [job.asciiGzFile]
+
+def getOutputFiles(job):
+    outputs = [job.ncFile+'_25.nc'] + [job.ncFile+suffix+'.nc' for suffix, gridSize in job.coarseGrids]
+    if 'glbnds'==job.kind: outputs += [job.ncFile+suffix+'_shares.nc' for suffix, gridSize in job.coarseGrids]
+    return outputs
+
+def getJobInputs(job, entry=None):
+    # [size, modification time, content hash] of the input files of a job, the files are hashed only if they have been
+    # touched since the last run of the job (entry is its manifest entry)
+    known = dict() if entry is None else entry.get('inputs', dict())
+    inputs = dict()
+    for fileName in getInputFiles(job) + ([] if job.pcountAsciiGzFile is None else [job.pcountAsciiGzFile]):
+        stamp = grid_cache.getFileStamp(fileName)
+        inputs[fileName] = known[fileName] if fileName in known and stamp==known[fileName][:2] else stamp+[hashing.fileHash(fileName)]
+    return inputs
+
+def getJobKey(job, codeHash, inputs):
+    pcountHash = None if job.pcountAsciiGzFile is None else inputs[job.pcountAsciiGzFile][2]
+    inputHash = inputs[job.asciiGzFile][2] if 'epochs'!=job.kind else [inputs[f][2] for f in job.asciiGzFile]
+    return hashing.combinedHash(inputHash, job.kind, job.year, [list(grid) for grid in job.coarseGrids], pcountHash, codeHash)
+
+def isUpToDate(job, key, manifest):
+    # the job can be skipped if it was done with the same key and its outputs haven't been changed since
+    entry = manifest.get(job.ncFile)
+    if entry is None or key!=entry['key']: return False
+    for ncFile in getOutputFiles(job):
+        if not os.path.exists(ncFile) or grid_cache.getFileStamp(ncFile)!=entry['outputs'].get(ncFile): return False
+    return True
+
+def loadManifest(manifestFile):
+    if not os.path.exists(manifestFile): return dict()
+    with open(manifestFile, 'r') as f:
+        return json.load(f)
+
+def saveManifest(manifest, manifestFile):
+    grid_cache.saveAtomic(manifestFile, lambda f: json.dump(manifest, f, indent=1, sort_keys=True), 'w')
+
+def runJob(job):
+    # runs one conversion (in a worker process), returns the job and the error message if it failed
+    try:
+        if 'glbnds'==job.kind:
+            convert_ntlnbd.convertSEDACglbndsAscii2nc(job.asciiGzFile, job.ncFile, job.coarseGrids, pcountAsciiGzFile=job.pcountAsciiGzFile)
+        elif 'epochs'==job.kind:
+            convert_pcount.convertSEDACpcountEpochs2nc(list(zip(job.year, job.asciiGzFile)), job.ncFile, job.coarseGrids)
+        else:
+            gridVariable = convert_pcount.PCOUNT if 'pcount'==job.kind else convert_pcount.PDENS
+            convert_pcount.convertSEDACpcountAscii2nc(job.asciiGzFile, job.ncFile, job.coarseGrids, job.year, gridVariable)
+        return job, None
+    except Exception:
+        return job, traceback.format_exc()
+
+def convertBatch(jobs, resultsDir, processes=None, force=False):
+    # runs the jobs whose results are missing or out of date in a process pool, returns the list of failed jobs
+    checkJobs(jobs)
+    manifestFile = os.path.join(resultsDir, MANIFEST_FILE)
+    manifest = loadManifest(manifestFile)
+    codeDir = os.path.dirname(os.path.abspath(__file__))
+    codeHash = hashing.combinedHash(*[hashing.fileHash(os.path.join(codeDir, codeFile)) for codeFile in CODE_FILES])
+    keys = dict()
+    inputs = dict()
+    todo = list()
+    for job in jobs:
+        inputs[job.ncFile] = getJobInputs(job, manifest.get(job.ncFile))
+        keys[job.ncFile] = getJobKey(job, codeHash, inputs[job.ncFile])
+        if not force and isUpToDate(job, keys[job.ncFile], manifest):
+            log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   '+job.ncFile+' is up to date\n')
+        else: todo.append(job)
+    if not todo: return list()
+    if not os.path.isdir(resultsDir): os.makedirs(resultsDir)
+    failed = list()
+    if 1==len(todo) or 1==processes:
+        results = (runJob(job) for job in todo)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(todo)))
+        results = pool.imap_unordered(runJob, todo)
+    try:
+        for job, error in results:
+            if error is None:
+                manifest[job.ncFile] = {'key': keys[job.ncFile], 'asciiGzFile': job.asciiGzFile, 'inputs': inputs[job.ncFile],
+                                        'outputs': dict((ncFile, grid_cache.getFileStamp(ncFile)) for ncFile in getOutputFiles(job))}
+                saveManifest(manifest, manifestFile)
+            else:
+                log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   '+' '.join(getInputFiles(job))+' failed:\n'+error)
+                failed.append(job)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return failed
+
+def parseCoarseGrid(text):
+    # '_half:0.5' -> ('_half', 0.5)
+    suffix, sep, gridSize = text.rpartition(':')
+    if not sep: raise argparse.ArgumentTypeError('coarse grids must be given as suffix:gridsize (e.g. _half:0.5)')
+    return suffix, float(gridSize)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Converts SEDAC GPW v3 ascii files into netCDF format in parallel.')
+    parser.add_argument('--glbnds', nargs='*', default=[], help='national identifier grid files (glbnds.asc.gz)')
+    parser.add_argument('--pcount', nargs='*', default=[], help='population count grid files of any epochs (glpXXag.asc.gz)')
+    parser.add_argument('--density', nargs='*', default=[], help='population density grid files of any epochs (gldsXXag.asc.gz)')
+    parser.add_argument('--epochs', action='store_true', help='stack the population count epochs into (year, lat, lon) grids too')
+    parser.add_argument('--shares-pcount', default=None,
+                        help='2.5\' population count file of the population shares of the lower resolution glbnds grids (glp00ag.asc.gz)')
+    parser.add_argument('--results', default='results', help='results folder (default: results)')
+    parser.add_argument('--coarse', nargs='*', type=parseCoarseGrid, default=convert_pcount.COARSE_GRIDS,
+                        help='lower resolution grids as suffix:gridsize (default: _half:0.5)')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (default: number of cores)')
+    parser.add_argument('--force', action='store_true', help='convert the files even if they are up to date')
+    args = parser.parse_args()
+    jobs = createJobs('glbnds', args.glbnds, args.results, args.coarse, args.shares_pcount) + \
+           createJobs('pcount', args.pcount, args.results, args.coarse) + \
+           createJobs('pdens', args.density, args.results, args.coarse)
+    if args.epochs and args.pcount: jobs.append(createEpochsJob(args.pcount, args.results, args.coarse))
+    failed = convertBatch(jobs, args.results, args.processes, args.force)
+    log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   batch conversion ready ({0} jobs, {1} failed)\n'.format(len(jobs), len(failed)))
+    sys.exit(1 if failed else 0)
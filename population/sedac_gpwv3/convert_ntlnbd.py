@@ -8,141 +8,105 @@ Code is written and tested under Python 2.7
 @license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
 @author: Mate Rozsai
 '''
-import sys
-import datetime
-import csv
-import gzip
+import os
 import numpy
-import netCDF4
-    
-def convertSEDACglbndsAscii2nc(asciiGzFile, ncFile):
-    def log(message):
-        sys.stdout.write(message)
+import sedac_ascii
+import sedac_nc
+import grid_cache
+import downsampling
+import instrumentation
+import country_shares
 
-    def createAllMaskedArray(dimA, dimB, defValue):
-        res = numpy.ma.array(numpy.zeros([dimA, dimB])) 
-        res[:,:] = defValue
-        return res
+# lower resolution grids created besides the original 2.5' one: (file name suffix, grid size in degrees)
+# e.g. [('_5m', 5/60.0), ('_15m', 0.25), ('_half', 0.5), ('_1deg', 1.0)]
+COARSE_GRIDS = [('_half', 0.5)]
+# the ratio of sea cells under which a lower resolution cell still gets the country, for countries
+# that are too small for the general 1/2 rule: Malta (code=134) - add more countries if needed
+SEA_THRESHOLD_OVERRIDES = {134: 0.9}
 
-    def saveSEDACncFile(lats, lons, variable, ncFile, NODATA_value):
-        #write result to netCDF file
-        nc = netCDF4.Dataset(ncFile, 'w', format='NETCDF4')
-        
-        nc.createDimension('lat', lats.size)
-        nc.createDimension('lon', lons.size)
-        
-        rvLat = nc.createVariable('lat','f8',('lat',))
-        rvLat.setncattr('standard_name', 'latitude')
-        rvLat.setncattr('long_name', 'latitude')
-        rvLat.setncattr('axis', 'Y')
-        rvLat.units = 'degrees_north'
-        rvLat[:] = lats
-        
-        rvLon = nc.createVariable('lon','f8',('lon',))
-        rvLon.setncattr('standard_name', 'longitude')
-        rvLon.setncattr('long_name', 'longitude')
-        rvLon.setncattr('axis', 'X')
-        rvLon.units = 'degrees_east'
-        rvLon[:] = lons
-        
-        rvVar = nc.createVariable('glbnds','i4',('lat','lon',),fill_value=NODATA_value)
-        rvVar.setncattr('long_name', 'Raster representation of nation-states of year 2000 (SEDAC GPWv3)')
-        rvVar.units = 'GPWv3 bndsg ids'
-        rvVar.setncattr('standard_name', 'National boundaries')
-        rvVar[:,:] = variable[:,:]
-        nc.close()
-        
-    def loadAsciiFile(asciiGzFile, dtype):
-        # ****** loading the ascii file   
-        log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   reading sedac ascii file (can take a while).')
-        # checking header rows
-        with gzip.open(asciiGzFile, 'rb') as fcsv:
-            reader = csv.reader(fcsv, delimiter=' ', quoting=csv.QUOTE_NONE)
-            row = next(reader)
-            if 'ncols'!=row[0]: raise Exception('IO error', 'Invalid 1st line: does not start with "ncols".')
-            else: ncols = int(row[-1])
-            row = next(reader)
-            if 'nrows'!=row[0]: raise Exception('IO error', 'Invalid 2nd line: does not start with "nrows".')
-            else: nrows = int(row[-1])
-            row = next(reader)
-            if 'xllcorner'!=row[0]: raise Exception('IO error', 'Invalid 3rd line: does not start with "xllcorner".')
-            else: xllcorner = float(row[-1])
-            if -180!=xllcorner: raise Exception('IO error', 'Invalid 3rd line: "xllcorner" must be -180 (correct the script otherwise).')
-            row = next(reader)
-            if 'yllcorner'!=row[0]: raise Exception('IO error', 'Invalid 4th line: does not start with "yllcorner".')
-            else: yllcorner = float(row[-1])
-            if 0<yllcorner: raise Exception('IO error', 'Invalid 4th line: "yllcorner" must be negative (correct the script otherwise).')
-            row = next(reader)
-            if 'cellsize'!=row[0]: raise Exception('IO error', 'Invalid 5th line: does not start with "cellsize".')
-            row = next(reader)
-            if 'NODATA_value'!=row[0]: raise Exception('IO error', 'Invalid 6th line: does not start with "NODATA_value".')
-            else: NODATA_value = row[-1]
-        # reading data
-        log('.')
-        var_asc = numpy.ma.masked_values(numpy.loadtxt(asciiGzFile, dtype=dtype, skiprows=6), int(NODATA_value))
-        log('.\n')
-        return ncols, nrows, yllcorner, NODATA_value, var_asc 
+GLBNDS_ATTRIBUTES = {'long_name': 'Raster representation of nation-states of year 2000 (SEDAC GPWv3)',
+                     'units': 'GPWv3 bndsg ids',
+                     'standard_name': 'National boundaries'}
 
-    def createNcFile(ncols, nrows, yllcorner, NODATA_value, var_asc, defValue, ncFile):
-        # ****** generating nc file
-        log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+"]   creating 2.5' nc file...")
-        # calculating the lat and lon coordinates
-        lons = numpy.zeros([ncols])
-        lats = numpy.zeros([int(ncols/2)])
-        gridSize = 360.0 / ncols             
-        for i in range(lons.size): lons[i] = -180.0 + gridSize/2 + i*gridSize
-        for i in range(lats.size): lats[i] = 90.0 - gridSize/2 - i*gridSize
-        # reordering ascii variable according to lats and lons
-        var_nc = createAllMaskedArray(lats.size, lons.size, defValue)
-        startLat = int(round((90.0-(yllcorner+gridSize*nrows))/gridSize-1))
-        stopLat = int(round((90.0-yllcorner)/gridSize-1))
-        for idxLat in range(startLat,stopLat): 
-            var_nc[idxLat,:]=var_asc[idxLat-startLat,:]
-            if 0 == idxLat % int((stopLat-startLat)/20): log('.')
-        saveSEDACncFile(lats, lons, var_nc, ncFile + '_25.nc', int(NODATA_value))
-        log('..\n')
-        
-    def createHalfDegreeNcFile(ncols, nrows, yllcorner, NODATA_value, glbnds_asc, ncFile):
-        # create another resolution - half degree grid - from the original data
-        log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   creating 1/2° nc file...')
-        # calculating the lat and lon coordinates
-        gridSize = 0.5
-        lons = numpy.zeros([int(360/gridSize)])
-        lats = numpy.zeros([int(180/gridSize)])
-        for i in range(lons.size): lons[i] = -180 + gridSize/2 + i*gridSize
-        for i in range(lats.size): lats[i] = 90 - gridSize/2 - i*gridSize
-        # creating the result array with lower resolution
-        glbnds_half_nc = createAllMaskedArray(lats.size, lons.size, numpy.ma.masked)
-        startLat = int(round((90-(yllcorner+nrows*(360.0/ncols)))/gridSize-1))
-        stopLat = int(round((90-yllcorner)/gridSize-1))
-        dv = (int)(ncols/lons.size)                  # reshaping factor
-        tmp = numpy.ma.empty([dv, dv], dtype=int)
-        for idxLat in range(startLat,stopLat):
-            idxOriLat = (idxLat-startLat)*dv
-            for idxLon in range(lons.size):
-                idxOriLon = idxLon*dv
-                # get a dv*dv square from the original data that corresponds to the new cell
-                tmp[:,:]=glbnds_asc[idxOriLat:idxOriLat+dv,idxOriLon:idxOriLon+dv]
-                # check if it's all see or else which country has the most cells of the above square
-                seaCount = numpy.ma.count_masked(tmp) 
-                if (seaCount<dv*dv): # if not all masked     
-                    country = numpy.argmax(numpy.bincount(tmp.compressed()))
-                    # if half of the cells is not see, it gets the country
-                    # except for Malta (code=134), as it's too small - add more countries if needed
-                    if (numpy.ma.count_masked(tmp)<dv*dv/2) or \
-                       (134==country and numpy.ma.count_masked(tmp)<dv*dv*0.9):  
-                        glbnds_half_nc[idxLat,idxLon]=country
-                    else: glbnds_half_nc[idxLat,idxLon]=numpy.ma.masked
-                else: glbnds_half_nc[idxLat,idxLon]=numpy.ma.masked
-            if 0 == idxLat % int((stopLat-startLat)/20): log('.')
-        saveSEDACncFile(lats, lons, glbnds_half_nc, ncFile+'_half.nc', int(NODATA_value))
-        log('.\n')
+def convertSEDACglbndsAscii2nc(asciiGzFile, ncFile, coarseGrids=COARSE_GRIDS, gridCacheDir=grid_cache.GRID_CACHE_DIR, pcountAsciiGzFile=None, shares=True):
+    # Besides the majority vote grids, the country shares of the lower resolution grids are written into <ncFile><suffix>_shares.nc
+    # files if shares is set (with the population shares too if the 2.5' population count file is given, see country_shares.py)
+    def createSEDACncFile(header, gridSize, ncFile):
+        # creates the nc file of one resolution with int16 ids, the data is written into it band by band
+        nc, rvVar = sedac_nc.createSEDACncFile(ncFile, gridSize, 'glbnds', 'i2', int(header.NODATA_value), GLBNDS_ATTRIBUTES)
+        return nc, rvVar, sedac_nc.getStartLat(header, gridSize)
 
-    # Converting the SEDAC ascii file to netCDF file
-    ncols, nrows, yllcorner, NODATA_value, var_asc = loadAsciiFile(asciiGzFile, 'int')
-    createNcFile(ncols, nrows, yllcorner, NODATA_value, var_asc, numpy.ma.masked, ncFile) 
-    createHalfDegreeNcFile(ncols, nrows, yllcorner, NODATA_value, var_asc, ncFile)
-    log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   glbnds translation ready\n')
+    # Converting the SEDAC ascii file to netCDF files, the 2.5' grid and the lower resolution grids are created band by band
+    # the parsing, the downsampling and the writing of the bands are measured as separate stages
+    header = sedac_ascii.readAsciiHeader(asciiGzFile)
+    if 32767<header.NODATA_value or header.NODATA_value<-32768: raise Exception('IO error', 'NODATA_value does not fit into int16.')
+    if shares and pcountAsciiGzFile is not None:
+        pcountHeader = sedac_ascii.readAsciiHeader(pcountAsciiGzFile)
+        if header[:4]!=pcountHeader[:4] or 1e-9<abs(header.cellsize-pcountHeader.cellsize): raise Exception('IO error', 'The population count grid is not co-registered with the glbnds grid.')
+    cells = header.nrows*header.ncols
+    parse = instrumentation.Stage('glbnds/parse', cells=cells, bytesRead=instrumentation.fileSize(asciiGzFile))
+    downsample = instrumentation.Stage('glbnds/downsample')
+    write = instrumentation.Stage('glbnds/write')
+    share = instrumentation.Stage('glbnds/shares')
+    # (reshaping factor, nc dataset, grid variable, index of the first data row) of every resolution
+    grids = list()
+    ncFiles = [ncFile+'_25.nc'] + [ncFile+suffix+'.nc' for suffix, gridSize in coarseGrids]
+    # (reshaping factor, nc dataset, index of the first data row) of the shares files
+    sharesGrids = list()
+    if shares: ncFiles += [ncFile+suffix+'_shares.nc' for suffix, gridSize in coarseGrids]
+    with instrumentation.stage('glbnds', cells=cells, bytesRead=parse.bytesRead) as total:
+        try:
+            with write:
+                grids.append((1,) + createSEDACncFile(header, 360.0/header.ncols, ncFiles[0]))
+                for (suffix, gridSize), coarseNcFile in zip(coarseGrids, ncFiles[1:]):
+                    grids.append((sedac_nc.getReshapingFactor(header, gridSize),) + createSEDACncFile(header, gridSize, coarseNcFile))
+                    if shares:
+                        sharesNc = country_shares.createSharesNcFile(ncFile+suffix+'_shares.nc', gridSize, pcountAsciiGzFile is not None, GLBNDS_ATTRIBUTES)
+                        sharesGrids.append((grids[-1][0], sharesNc, grids[-1][3]))
+            bandRows = sedac_ascii.getBandRows([grid[0] for grid in grids])
+            # the parsed grid is read from (or written into) the memory-mapped grid cache, unless it's disabled
+            if gridCacheDir is None: bands = sedac_ascii.iterAsciiBands(asciiGzFile, 'int32', bandRows)
+            else: bands = grid_cache.iterAsciiBands(asciiGzFile, 'int32', bandRows, gridCacheDir)
+            # the population count bands are read in parallel for the population shares
+            if not sharesGrids or pcountAsciiGzFile is None: pcountBands = None
+            elif gridCacheDir is None: pcountBands = sedac_ascii.iterAsciiBands(pcountAsciiGzFile, 'float32', bandRows)
+            else: pcountBands = grid_cache.iterAsciiBands(pcountAsciiGzFile, 'float32', bandRows, gridCacheDir)
+            rowAreas = country_shares.getRowAreas(header) if sharesGrids else None
+            for firstRow, band in instrumentation.timedIter(bands, parse):
+                if 32767<band.max(): raise Exception('IO error', 'Country ids do not fit into int16.')
+                glbnds_band = numpy.ma.masked_equal(band, header.NODATA_value, copy=False)
+                for dv, nc, rvVar, startLat in grids:
+                    # a lower resolution cell gets the country that has the most cells in the corresponding dv*dv square
+                    # if less than half of the square is sea
+                    if 1==dv: res = glbnds_band
+                    else:
+                        with downsample:
+                            res = downsampling.blockMajority(glbnds_band, dv, seaThreshold=0.5, overrides=SEA_THRESHOLD_OVERRIDES)
+                        downsample.count(cells=band.size)
+                    with write:
+                        rvVar[startLat+firstRow//dv:startLat+firstRow//dv+res.shape[0],:] = res
+                    write.count(cells=res.size)
+                if sharesGrids:
+                    with share:
+                        pcount_band = None
+                        if pcountBands is not None:
+                            pcountFirstRow, pcount_band = next(pcountBands)
+                            pcount_band = numpy.ma.masked_equal(pcount_band, pcountHeader.NODATA_value, copy=False)
+                        for dv, sharesNc, startLat in sharesGrids:
+                            rows, cols, ids, areaShare, popShare = country_shares.getBandShares(glbnds_band, pcount_band, dv, rowAreas[firstRow:firstRow+band.shape[0]])
+                            country_shares.appendShares(sharesNc, startLat+firstRow//dv+rows, cols, ids, areaShare, popShare)
+                    share.count(cells=band.size)
+        finally:
+            with write:
+                for grid in grids: grid[1].close()
+                for grid in sharesGrids: grid[1].close()
+        write.count(bytesWritten=sum(instrumentation.fileSize(fileName) for fileName in ncFiles))
+        total.count(bytesWritten=write.bytesWritten)
+        for s in (parse, downsample, share, write):
+            if s.calls: s.report()
 
 if __name__ == "__main__":
-    convertSEDACglbndsAscii2nc('gl_gpwv3_ntlbndid_ascii_25/glbnds.asc.gz', 'results/glbnds')
\ No newline at end of file
+    # the population shares need the population count grid, which isn't in the repo (area shares are written without it)
+    pcountAsciiGzFile = 'gl_gpwv3_pcount_00_ascii_25/glp00ag.asc.gz'
+    convertSEDACglbndsAscii2nc('gl_gpwv3_ntlbndid_ascii_25/glbnds.asc.gz', 'results/glbnds',
+                               pcountAsciiGzFile=pcountAsciiGzFile if os.path.exists(pcountAsciiGzFile) else None)
\ No newline at end of file
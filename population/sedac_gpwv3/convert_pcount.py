@@ -8,129 +8,121 @@ Code is written and tested under Python 2.7
 @license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
 @author: Mate Rozsai
 '''
-import sys
-import datetime
-import csv
-import gzip
+import collections
 import numpy
-import netCDF4
-    
-def convertSEDACpcountAscii2nc(asciiGzFile, ncFile):
-    def log(message):
-        sys.stdout.write(message)
+import sedac_ascii
+import sedac_nc
+import grid_cache
+import downsampling
+import instrumentation
+
+# lower resolution grids created besides the original 2.5' one: (file name suffix, grid size in degrees)
+# e.g. [('_5m', 5/60.0), ('_15m', 0.25), ('_half', 0.5), ('_1deg', 1.0)]
+COARSE_GRIDS = [('_half', 0.5)]
 
-    def createAllMaskedArray(dimA, dimB, defValue):
-        res = numpy.ma.array(numpy.zeros([dimA, dimB])) 
-        res[:,:] = defValue
-        return res
+# netCDF variable of the converted grid ({0} in the long name is the year of the epoch)
+# and the block reduction that creates the lower resolution grids
+GridVariable = collections.namedtuple('GridVariable', 'name long_name units standard_name reduction')
+PCOUNT = GridVariable(name='pcount', long_name='Population counts in {0} adjusted to match UN totals (SEDAC GPWv3)',
+                      units='persons', standard_name='population', reduction=downsampling.blockSum)
+PDENS = GridVariable(name='pdens', long_name='Population density in {0} adjusted to match UN totals (SEDAC GPWv3)',
+                     units='persons km-2', standard_name='population_density', reduction=downsampling.blockMean)
+    
+def createGrids(header, ncFiles, coarseGrids, gridVariable, year, years=None):
+    # Creates the nc files of every resolution with float32 values (a (year, lat, lon) stack if the years are given),
+    # returns the (reshaping factor, nc dataset, grid variable, index of the first data row) of every resolution
+    # (the rows outside the SEDAC data get 0 population)
+    attributes = {'long_name': gridVariable.long_name.format(year), 'units': gridVariable.units, 'standard_name': gridVariable.standard_name}
+    grids = list()
+    try:
+        gridSizes = [360.0/header.ncols] + [gridSize for suffix, gridSize in coarseGrids]
+        for dv, gridSize, ncFile in zip([1]+[sedac_nc.getReshapingFactor(header, gridSize) for gridSize in gridSizes[1:]], gridSizes, ncFiles):
+            nc, rvVar = sedac_nc.createSEDACncFile(ncFile, gridSize, gridVariable.name, 'f4', 1e+20, attributes, years=years)
+            grids.append((dv, nc, rvVar, sedac_nc.getStartLat(header, gridSize)))
+            nrows = (header.nrows+dv-1)//dv
+            for index in ([()] if years is None else [(i,) for i in range(len(years))]):
+                sedac_nc.fillRows(rvVar, 0, grids[-1][3], 0.0, index=index)
+                sedac_nc.fillRows(rvVar, grids[-1][3]+nrows, rvVar.shape[-2], 0.0, index=index)
+    except:
+        for grid in grids: grid[1].close()
+        raise
+    return grids
 
-    def saveSEDACncFile(lats, lons, variable, ncFile, NODATA_value):
-        #write result to netCDF file
-        nc = netCDF4.Dataset(ncFile, 'w', format='NETCDF4')
-        
-        nc.createDimension('lat', lats.size)
-        nc.createDimension('lon', lons.size)
-        
-        rvLat = nc.createVariable('lat','f8',('lat',))
-        rvLat.setncattr('standard_name', 'latitude')
-        rvLat.setncattr('long_name', 'latitude')
-        rvLat.setncattr('axis', 'Y')
-        rvLat.units = 'degrees_north'
-        rvLat[:] = lats
-        
-        rvLon = nc.createVariable('lon','f8',('lon',))
-        rvLon.setncattr('standard_name', 'longitude')
-        rvLon.setncattr('long_name', 'longitude')
-        rvLon.setncattr('axis', 'X')
-        rvLon.units = 'degrees_east'
-        rvLon[:] = lons
-        
-        rvVar = nc.createVariable('pcount','f4',('lat','lon',), fill_value=1e+20)
-        rvVar.setncattr('long_name', 'Population counts in 2000 adjusted to match UN totals (SEDAC GPWv3)')
-        rvVar.units = 'persons'
-        rvVar.setncattr('standard_name', 'population')
-        rvVar[:,:] = variable[:,:]
-        nc.close()
-        
-    def loadAsciiFile(asciiGzFile, dtype):
-        # ****** loading the ascii file   
-        log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   reading sedac ascii file (can take a while).')
-        # checking header rows
-        with gzip.open(asciiGzFile, 'rb') as fcsv:
-            reader = csv.reader(fcsv, delimiter=' ', quoting=csv.QUOTE_NONE)
-            row = next(reader)
-            if 'ncols'!=row[0]: raise Exception('IO error', 'Invalid 1st line: does not start with "ncols".')
-            else: ncols = int(row[-1])
-            row = next(reader)
-            if 'nrows'!=row[0]: raise Exception('IO error', 'Invalid 2nd line: does not start with "nrows".')
-            else: nrows = int(row[-1])
-            row = next(reader)
-            if 'xllcorner'!=row[0]: raise Exception('IO error', 'Invalid 3rd line: does not start with "xllcorner".')
-            else: xllcorner = float(row[-1])
-            if -180!=xllcorner: raise Exception('IO error', 'Invalid 3rd line: "xllcorner" must be -180 (correct the script otherwise).')
-            row = next(reader)
-            if 'yllcorner'!=row[0]: raise Exception('IO error', 'Invalid 4th line: does not start with "yllcorner".')
-            else: yllcorner = float(row[-1])
-            if 0<yllcorner: raise Exception('IO error', 'Invalid 4th line: "yllcorner" must be negative (correct the script otherwise).')
-            row = next(reader)
-            if 'cellsize'!=row[0]: raise Exception('IO error', 'Invalid 5th line: does not start with "cellsize".')
-            row = next(reader)
-            if 'NODATA_value'!=row[0]: raise Exception('IO error', 'Invalid 6th line: does not start with "NODATA_value".')
-            else: NODATA_value = row[-1]
-        # reading data
-        log('.')
-        var_asc = numpy.ma.masked_values(numpy.loadtxt(asciiGzFile, dtype=dtype, skiprows=6), int(NODATA_value))
-        log('.\n')
-        return ncols, nrows, yllcorner, NODATA_value, var_asc 
+def writeBands(asciiGzFile, header, grids, gridVariable, stages, gridCacheDir, index=()):
+    # Streams the bands of a SEDAC ascii file into the grids of every resolution (index selects the grid of a stack)
+    # stages: (parse, downsample, write) stages of the instrumentation
+    parse, downsample, write = stages
+    bandRows = sedac_ascii.getBandRows([grid[0] for grid in grids])
+    # the parsed grid is read from (or written into) the memory-mapped grid cache, unless it's disabled
+    if gridCacheDir is None: bands = sedac_ascii.iterAsciiBands(asciiGzFile, 'float32', bandRows)
+    else: bands = grid_cache.iterAsciiBands(asciiGzFile, 'float32', bandRows, gridCacheDir)
+    for firstRow, band in instrumentation.timedIter(bands, parse):
+        pcount_band = numpy.ma.masked_equal(band, header.NODATA_value, copy=False)
+        for dv, nc, rvVar, startLat in grids:
+            # a lower resolution cell gets the sum (counts) or mean (densities) of the corresponding dv*dv square
+            # (masked if all of it is masked)
+            if 1==dv: res = pcount_band
+            else:
+                with downsample:
+                    res = gridVariable.reduction(pcount_band, dv)
+                downsample.count(cells=band.size)
+            with write:
+                rvVar[index+(slice(startLat+firstRow//dv, startLat+firstRow//dv+res.shape[0]), slice(None))] = res
+            write.count(cells=res.size)
 
-    def createNcFile(ncols, nrows, yllcorner, NODATA_value, var_asc, defValue, ncFile):
-        # ****** generating nc file
-        log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+"]   creating 2.5' nc file...")
-        # calculating the lat and lon coordinates
-        lons = numpy.zeros([ncols])
-        lats = numpy.zeros([int(ncols/2)])
-        gridSize = 360.0 / ncols             
-        for i in range(lons.size): lons[i] = -180.0 + gridSize/2 + i*gridSize
-        for i in range(lats.size): lats[i] = 90.0 - gridSize/2 - i*gridSize
-        # reordering ascii variable according to lats and lons
-        var_nc = createAllMaskedArray(lats.size, lons.size, defValue)
-        startLat = int(round((90.0-(yllcorner+gridSize*nrows))/gridSize-1))
-        stopLat = int(round((90.0-yllcorner)/gridSize-1))
-        for idxLat in range(startLat,stopLat): 
-            var_nc[idxLat,:]=var_asc[idxLat-startLat,:]
-            if 0 == idxLat % int((stopLat-startLat)/20): log('.')
-        saveSEDACncFile(lats, lons, var_nc, ncFile + '_25.nc', int(NODATA_value))
-        log('..\n')
-        
-    def createHalfDegreeNcFile(ncols, nrows, yllcorner, NODATA_value, glbnds_asc, ncFile):
-        # create another resolution - half degree grid - from the original data
-        log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   creating 1/2° nc file...')
-        # calculating the lat and lon coordinates
-        gridSize = 0.5
-        lons = numpy.zeros([int(360/gridSize)])
-        lats = numpy.zeros([int(180/gridSize)])
-        for i in range(lons.size): lons[i] = -180 + gridSize/2 + i*gridSize
-        for i in range(lats.size): lats[i] = 90 - gridSize/2 - i*gridSize
-        # creating the result array with lower resolution
-        glbnds_half_nc = createAllMaskedArray(lats.size, lons.size, 0.0)
-        startLat = int(round((90-(yllcorner+nrows*(360.0/ncols)))/gridSize-1))
-        stopLat = int(round((90-yllcorner)/gridSize-1))
-        dv = (int)(ncols/lons.size)                  # reshaping factor
-        for idxLat in range(startLat,stopLat):
-            idxOriLat = (idxLat-startLat)*dv
-            for idxLon in range(lons.size):
-                idxOriLon = idxLon*dv
-                # the new value is the sum of the dv*dv square from the original data 
-                glbnds_half_nc[idxLat,idxLon]=numpy.sum(glbnds_asc[idxOriLat:idxOriLat+dv,idxOriLon:idxOriLon+dv])
-            if 0 == idxLat % int((stopLat-startLat)/20): log('.')
-        saveSEDACncFile(lats, lons, glbnds_half_nc, ncFile+'_half.nc', int(NODATA_value))
-        log('.\n')
+def convertSEDACpcountAscii2nc(asciiGzFile, ncFile, coarseGrids=COARSE_GRIDS, year=2000, gridVariable=PCOUNT, gridCacheDir=grid_cache.GRID_CACHE_DIR):
+    # Converting the SEDAC ascii file to netCDF files, the 2.5' grid and the lower resolution grids are created band by band
+    # the parsing, the downsampling and the writing of the bands are measured as separate stages
+    header = sedac_ascii.readAsciiHeader(asciiGzFile)
+    cells = header.nrows*header.ncols
+    parse = instrumentation.Stage(gridVariable.name+'/parse', cells=cells, bytesRead=instrumentation.fileSize(asciiGzFile))
+    downsample = instrumentation.Stage(gridVariable.name+'/downsample')
+    write = instrumentation.Stage(gridVariable.name+'/write')
+    grids = list()
+    ncFiles = [ncFile+'_25.nc'] + [ncFile+suffix+'.nc' for suffix, gridSize in coarseGrids]
+    with instrumentation.stage(gridVariable.name, cells=cells, bytesRead=parse.bytesRead) as total:
+        try:
+            with write:
+                grids = createGrids(header, ncFiles, coarseGrids, gridVariable, year)
+            writeBands(asciiGzFile, header, grids, gridVariable, (parse, downsample, write), gridCacheDir)
+        finally:
+            with write:
+                for grid in grids: grid[1].close()
+        write.count(bytesWritten=sum(instrumentation.fileSize(fileName) for fileName in ncFiles))
+        total.count(bytesWritten=write.bytesWritten)
+        for s in (parse, downsample, write):
+            if s.calls: s.report()
 
-    # Converting the SEDAC ascii file to netCDF file
-    ncols, nrows, yllcorner, NODATA_value, var_asc = loadAsciiFile(asciiGzFile, 'float')
-    createNcFile(ncols, nrows, yllcorner, NODATA_value, var_asc, 0.0, ncFile)
-    createHalfDegreeNcFile(ncols, nrows, yllcorner, NODATA_value, var_asc, ncFile)
-    log('['+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+']   pcount translation ready\n')
+def convertSEDACpcountEpochs2nc(epochs, ncFile, coarseGrids=COARSE_GRIDS, gridVariable=PCOUNT, gridCacheDir=grid_cache.GRID_CACHE_DIR):
+    # Converting the SEDAC ascii files of several epochs (list of (year, ascii file) tuples) to (year, lat, lon) stacks
+    # of every resolution, the epochs must have the same grid (e.g. glp90ag, glp95ag, glp00ag)
+    epochs = sorted(epochs)
+    years = [year for year, asciiGzFile in epochs]
+    if len(set(years))!=len(years): raise Exception('Invalid epochs', 'Every year must be given once.')
+    headers = [sedac_ascii.readAsciiHeader(asciiGzFile) for year, asciiGzFile in epochs]
+    header = headers[0]
+    for (year, asciiGzFile), h in zip(epochs, headers):
+        if h[:5]!=header[:5]: raise Exception('Different grids!', asciiGzFile+' has a different grid than '+epochs[0][1]+'.')
+    cells = header.nrows*header.ncols*len(epochs)
+    parse = instrumentation.Stage(gridVariable.name+'/parse', cells=cells, bytesRead=sum(instrumentation.fileSize(f) for year, f in epochs))
+    downsample = instrumentation.Stage(gridVariable.name+'/downsample')
+    write = instrumentation.Stage(gridVariable.name+'/write')
+    grids = list()
+    ncFiles = [ncFile+'_25.nc'] + [ncFile+suffix+'.nc' for suffix, gridSize in coarseGrids]
+    with instrumentation.stage(gridVariable.name+' epochs', cells=cells, bytesRead=parse.bytesRead) as total:
+        try:
+            with write:
+                grids = createGrids(header, ncFiles, coarseGrids, gridVariable, ', '.join(str(year) for year in years), years)
+            for i, (year, asciiGzFile) in enumerate(epochs):
+                # the NODATA value can be different in every epoch
+                writeBands(asciiGzFile, headers[i], grids, gridVariable, (parse, downsample, write), gridCacheDir, (i,))
+        finally:
+            with write:
+                for grid in grids: grid[1].close()
+        write.count(bytesWritten=sum(instrumentation.fileSize(fileName) for fileName in ncFiles))
+        total.count(bytesWritten=write.bytesWritten)
+        for s in (parse, downsample, write):
+            if s.calls: s.report()
 
 if __name__ == "__main__":
     convertSEDACpcountAscii2nc('gl_gpwv3_pcount_00_ascii_25/glp00ag.asc.gz', 'results/pcount')
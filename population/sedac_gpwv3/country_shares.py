@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+'''
+Fractional country shares of the lower resolution SEDAC GPW v3 grids
+
+Instead of giving every lower resolution cell to one country by majority vote, the shares file lists every
+(cell, country) pair with the share of the cell area and of the cell population that belongs to the country,
+computed from the original 2.5' grids. The area shares of a cell add up to its land ratio, the population shares
+to 1 (if the cell has any population). The pairs are stored as a sparse list in a netCDF file next to the
+lower resolution grid (e.g. glbnds_half_shares.nc with lat_index, lon_index, glbnds, area_share, pop_share variables).
+
+Regional totals of the lower resolution grids can be calculated with the accuracy of the 2.5' grid:
+    shares = country_shares.loadCountryShares('results/glbnds_half_shares.nc')
+    matrix = country_shares.getShareMatrix(shares, shares.popShare, mapping, size)
+    totPop = matrix.dot(numpy.ma.filled(pcountHalf, 0).ravel())
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import collections
+import netCDF4
+import numpy
+import scipy.sparse
+import sedac_nc
+import downsampling
+import weight_index
+
+# gridShape: shape of the (lat, lon) grid, cells: flat index of the cells of the pairs, ids: country ids,
+# areaShare, popShare: share of the cell area and population (popShare is None if it hasn't been calculated)
+CountryShares = collections.namedtuple('CountryShares', 'gridShape cells ids areaShare popShare')
+
+# number of (cell, country) pairs in a chunk of the shares file
+SHARE_CHUNK = 65536
+
+def getRowAreas(header):
+    # area of the cells of every row of a SEDAC ascii grid in km2
+    cellSize = 360.0/header.ncols
+    top = header.yllcorner + header.nrows*cellSize
+    return weight_index.getRowAreas(top - (numpy.arange(header.nrows)+0.5)*cellSize, cellSize)
+
+def getBandShares(glbnds, pcount, factor, rowAreas):
+    # Calculates the country shares of a band of the original grid (its number of rows must be a multiple of the factor,
+    # except the last band), returns the (row, col) of the reduced cells, the country ids, the area and population shares
+    # (population shares are None if pcount is None)
+    blat, blon = downsampling.getBlockShape(glbnds.shape, factor)
+    area = numpy.broadcast_to(rowAreas[:,numpy.newaxis], glbnds.shape)
+    weights = [area] if pcount is None else [area, pcount]
+    cells, ids, sums = downsampling.blockZonalSums(glbnds, factor, weights)
+    rows, cols = cells//blon, cells%blon
+    # area of the reduced cells (including sea), the squares at the right edge can be partial
+    blockRowArea = numpy.add.reduceat(rowAreas, numpy.arange(0, rowAreas.size, factor))
+    blockCols = numpy.minimum(factor, glbnds.shape[1]-numpy.arange(blon)*factor)
+    areaShare = sums[0]/(blockRowArea[rows]*blockCols[cols])
+    popShare = None
+    if pcount is not None:
+        population = numpy.bincount(cells-cells.min(), weights=sums[1])[cells-cells.min()] if cells.size else sums[1]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            popShare = numpy.where(0<population, sums[1]/population, 0.0)
+    return rows, cols, ids, areaShare, popShare
+
+def createSharesNcFile(ncFile, gridSize, population, attributes):
+    # Creates the shares file of a grid with empty (unlimited) pair variables, the pairs are appended band by band
+    nc = sedac_nc.createGridDataset(ncFile, gridSize)
+    nc.createDimension('share', None)
+    variables = [('lat_index', 'i4', 'lat index of the cell'), ('lon_index', 'i4', 'lon index of the cell'),
+                 ('glbnds', 'i2', attributes['long_name']), ('area_share', 'f4', 'Share of the cell area that belongs to the country')]
+    if population: variables.append(('pop_share', 'f4', 'Share of the cell population that belongs to the country'))
+    for name, dtype, longName in variables:
+        rvVar = nc.createVariable(name, dtype, ('share',), zlib=True, complevel=sedac_nc.COMPRESSION_LEVEL, shuffle=True, chunksizes=(SHARE_CHUNK,))
+        rvVar.setncattr('long_name', longName)
+    nc.variables['glbnds'].setncattr('units', attributes['units'])
+    nc.variables['area_share'].setncattr('units', '1')
+    if population: nc.variables['pop_share'].setncattr('units', '1')
+    return nc
+
+def appendShares(nc, rows, cols, ids, areaShare, popShare):
+    first = len(nc.dimensions['share'])
+    last = first + ids.size
+    nc.variables['lat_index'][first:last] = rows
+    nc.variables['lon_index'][first:last] = cols
+    nc.variables['glbnds'][first:last] = ids
+    nc.variables['area_share'][first:last] = areaShare
+    if popShare is not None: nc.variables['pop_share'][first:last] = popShare
+
+def loadCountryShares(sharesFile):
+    # Reads the (cell, country) pairs of a shares file
+    nc = netCDF4.Dataset(sharesFile, 'r')
+    try:
+        gridShape = (len(nc.dimensions['lat']), len(nc.dimensions['lon']))
+        cells = nc.variables['lat_index'][:].astype('int64')*gridShape[1] + nc.variables['lon_index'][:]
+        popShare = numpy.ma.getdata(nc.variables['pop_share'][:]) if 'pop_share' in nc.variables else None
+        return CountryShares(gridShape=gridShape, cells=numpy.ma.getdata(cells), ids=numpy.ma.getdata(nc.variables['glbnds'][:]),
+                             areaShare=numpy.ma.getdata(nc.variables['area_share'][:]), popShare=popShare)
+    finally:
+        nc.close()
+
+def getShareMatrix(shares, values, mapping=None, size=None):
+    # Sparse [regions x grid cells] matrix of the shares (values is shares.areaShare or shares.popShare), mapping assigns
+    # a region index to every country id (negative if the country doesn't belong to any region), the default is one region per id
+    ids = shares.ids.astype('int64')
+    if mapping is None: regions = ids
+    else:
+        mapping = numpy.asarray(mapping)
+        regions = numpy.where((0<=ids) & (ids<mapping.size), mapping[numpy.clip(ids, 0, mapping.size-1)], -1)
+    if size is None: size = int(regions.max())+1 if regions.size else 0
+    valid = (0<=regions) & (regions<size)
+    return scipy.sparse.csr_matrix((numpy.asarray(values, dtype='float64')[valid], (regions[valid], shares.cells[valid])),
+                                   shape=(size, shares.gridShape[0]*shares.gridShape[1]))
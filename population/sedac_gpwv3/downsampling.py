@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+'''
+Vectorized block reductions to create lower resolution grids from the SEDAC GPW v3 grids
+
+A grid is reduced by an integer factor: every factor*factor square of the original grid becomes one cell.
+The squares are reshaped into a new axis and reduced at once with numpy, a band of block rows at a time.
+Population counts are summed, densities are averaged, country ids are assigned by majority vote with sea thresholds,
+or the area/population of every country in every square is summed (country shares).
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import numpy
+
+# number of block rows reduced at once (bounds the size of the temporary arrays)
+BAND_BLOCKS = 16
+
+def getBlockShape(shape, factor):
+    # Shape of the reduced grid, partial blocks at the bottom and right edges are kept
+    if factor<1 or int(factor)!=factor: raise Exception('Invalid factor', 'Reshaping factor must be a positive integer.')
+    return (shape[0]+factor-1)//factor, (shape[1]+factor-1)//factor
+
+def iterBlockBands(var, factor, bandBlocks=BAND_BLOCKS):
+    # Yields (firstBlockRow, data, valid) tuples, where data and valid are [blockRows x blockCols x factor*factor] arrays
+    # of the original values (masked cells filled with 0) and of the validity of the cells
+    # partial blocks are padded with invalid cells
+    nlat, nlon = var.shape
+    blat, blon = getBlockShape(var.shape, factor)
+    for firstBlockRow in range(0, blat, bandBlocks):
+        rows = min(bandBlocks, blat-firstBlockRow)
+        band = var[firstBlockRow*factor:(firstBlockRow+rows)*factor,:]
+        data = numpy.zeros([rows*factor, blon*factor], dtype=band.dtype)
+        valid = numpy.zeros([rows*factor, blon*factor], dtype=bool)
+        data[:band.shape[0],:nlon] = numpy.ma.getdata(band)
+        valid[:band.shape[0],:nlon] = ~numpy.ma.getmaskarray(band)
+        data[~valid] = 0
+        yield firstBlockRow, toBlocks(data, factor), toBlocks(valid, factor)
+
+def toBlocks(var, factor):
+    # [nlat x nlon] -> [nlat/factor x nlon/factor x factor*factor], the squares become the last axis
+    nlat, nlon = var.shape
+    return var.reshape(nlat//factor, factor, nlon//factor, factor).swapaxes(1, 2).reshape(nlat//factor, nlon//factor, factor*factor)
+
+def blockSum(var, factor, dtype='float64', bandBlocks=BAND_BLOCKS):
+    # Sum of every factor*factor square of a masked grid, cells with an all masked square are masked
+    res = numpy.ma.masked_all(getBlockShape(var.shape, factor), dtype=dtype)
+    for firstBlockRow, data, valid in iterBlockBands(var, factor, bandBlocks):
+        rows = data.shape[0]
+        res[firstBlockRow:firstBlockRow+rows,:] = numpy.ma.array(data.sum(axis=2, dtype=dtype), mask=~valid.any(axis=2))
+    return res
+
+def blockMean(var, factor, dtype='float64', bandBlocks=BAND_BLOCKS):
+    # Mean of the unmasked cells of every factor*factor square of a masked grid, cells with an all masked square are masked
+    res = numpy.ma.masked_all(getBlockShape(var.shape, factor), dtype=dtype)
+    for firstBlockRow, data, valid in iterBlockBands(var, factor, bandBlocks):
+        rows = data.shape[0]
+        count = valid.sum(axis=2)
+        res[firstBlockRow:firstBlockRow+rows,:] = numpy.ma.array(data.sum(axis=2, dtype=dtype)/numpy.maximum(count, 1), mask=0==count)
+    return res
+
+def blockMajority(ids, factor, seaThreshold=0.5, overrides=None, bandBlocks=BAND_BLOCKS):
+    # Most frequent id of every factor*factor square of a masked id grid (masked cells are sea)
+    # a cell gets the id only if the ratio of sea cells in the square is below the threshold:
+    # seaThreshold in general and overrides[id] for the ids listed in the overrides dict (e.g. small island countries)
+    # ties are won by the smaller id
+    res = numpy.ma.masked_all(getBlockShape(ids.shape, factor), dtype=ids.dtype)
+    size = factor*factor
+    position = numpy.arange(size)
+    for firstBlockRow, data, valid in iterBlockBands(ids, factor, bandBlocks):
+        rows = data.shape[0]
+        # sea gets the smallest possible id, so it's sorted to the beginning of every square
+        sea = numpy.iinfo(data.dtype).min
+        data[~valid] = sea
+        data.sort(axis=2)
+        # length of the runs of equal ids in the sorted squares, the longest run is the majority
+        newRun = numpy.ones(data.shape, dtype=bool)
+        newRun[:,:,1:] = data[:,:,1:]!=data[:,:,:-1]
+        runLength = position + 1 - numpy.maximum.accumulate(numpy.where(newRun, position, 0), axis=2)
+        runLength[data==sea] = 0
+        country = numpy.take_along_axis(data, numpy.argmax(runLength, axis=2)[:,:,numpy.newaxis], axis=2)[:,:,0]
+        # applying the sea thresholds
+        threshold = numpy.empty(country.shape)
+        threshold[:,:] = seaThreshold
+        if overrides:
+            for cid, countryThreshold in overrides.items(): threshold[country==cid] = countryThreshold
+        seaCount = size - valid.sum(axis=2)
+        res[firstBlockRow:firstBlockRow+rows,:] = numpy.ma.array(country, mask=~(seaCount<threshold*size))
+    return res
+
+def blockZonalSums(ids, factor, weights, bandBlocks=BAND_BLOCKS):
+    # Sums of the weights of every id in every factor*factor square of a masked id grid (masked cells are skipped)
+    # weights is a list of grids with the same shape as ids (masked weights count as 0)
+    # returns (cells, zones, sums): flat index of the squares in the reduced grid, the ids and the [weights x entries] sums,
+    # the entries are ordered by cell and id
+    blat, blon = getBlockShape(ids.shape, factor)
+    cells, zones, sums = list(), list(), [list() for w in weights]
+    bands = [iterBlockBands(ids, factor, bandBlocks)] + [iterBlockBands(w, factor, bandBlocks) for w in weights]
+    for blockBands in zip(*bands):
+        firstBlockRow, data, valid = blockBands[0]
+        if not valid.any(): continue
+        # every (square, id) pair gets a code, the codes are in the order of the cells and ids
+        cell = firstBlockRow*blon + numpy.arange(data.shape[0]*data.shape[1], dtype='int64').reshape(data.shape[:2])
+        cell = numpy.repeat(cell[:,:,numpy.newaxis], data.shape[2], axis=2)[valid]
+        zone = data[valid].astype('int64')
+        minZone = zone.min()
+        zoneRange = zone.max()-minZone+1
+        codes, inverse = numpy.unique(cell*zoneRange + zone-minZone, return_inverse=True)
+        cells.append(codes//zoneRange)
+        zones.append(codes%zoneRange + minZone)
+        for i, (firstRow, weight, weightValid) in enumerate(blockBands[1:]):
+            sums[i].append(numpy.bincount(inverse.ravel(), weights=weight[valid].astype('float64'), minlength=codes.size))
+    if not cells: return numpy.zeros([0], dtype='int64'), numpy.zeros([0], dtype='int64'), numpy.zeros([len(weights), 0])
+    return numpy.concatenate(cells), numpy.concatenate(zones), numpy.array([numpy.concatenate(s) for s in sums]).reshape(len(weights), -1)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+'''
+Memory-mapped binary cache of the parsed SEDAC GPW v3 grids
+
+Every parsed grid (ascii file or netCDF variable) is written once as a raw .npy array, which is opened later
+memory-mapped (zero-copy) instead of decompressing and parsing the source again. A small json sidecar holds the
+grid geometry, the NODATA/fill value and the hash of the source file.
+An entry is valid while its source file has the same size and modification time, or the same content hash.
+The cache is limited in size: the least recently used entries are evicted when it gets bigger than the limit.
+
+The weight indexes, country extents and regrid weights built from the grids are stored in the same folder, they count
+into the size limit and are evicted the same way, temporary files left by crashed writes are removed after a day.
+The cache folder and size limit can be set with the SEDAC_GRID_CACHE and SEDAC_GRID_CACHE_SIZE (in MB)
+environment variables, the memory budget of the chunked processing of the grids with SEDAC_MEMORY_BUDGET (in MB).
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import re
+import json
+import time
+import numpy
+import netCDF4
+import hashing
+import sedac_ascii
+
+GRID_CACHE_DIR = os.environ.get('SEDAC_GRID_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'sedac_gpwv3'))
+GRID_CACHE_SIZE = int(os.environ.get('SEDAC_GRID_CACHE_SIZE', 4096))*(1<<20)
+# memory budget of the chunked and tiled processing of the grids (bytes)
+MEMORY_BUDGET = int(os.environ.get('SEDAC_MEMORY_BUDGET', 1024))*(1<<20)
+
+# number of rows copied at once from a netCDF variable into the cache
+BAND_ROWS = 240
+# files of the cache: the key (the grid entries, or the weight indexes, country extents and regrid weights built from
+# the grids) and the extension, temporary files of unfinished writes have the id of the writing process in the name
+CACHE_FILE = re.compile(r'^((?:weights_|extents_|regrid_)?[0-9a-f]{40})\.')
+TEMPORARY_FILE = re.compile(r'\.\d+\.tmp(\.|$)')
+# temporary files older than this (in seconds) are left by crashed writes
+STALE_TEMPORARY_AGE = 24*3600
+
+def getEntryFiles(cacheDir, source, *params):
+    # (data file, sidecar file) of a cache entry, the entry is identified by the absolute path of the source and the parameters
+    key = hashing.combinedHash(os.path.abspath(source), *params)
+    return os.path.join(cacheDir, key+'.npy'), os.path.join(cacheDir, key+'.json')
+
+def getFileStamp(fileName):
+    stat = os.stat(fileName)
+    return [stat.st_size, int(stat.st_mtime)]
+
+def loadSidecar(source, npyFile, jsonFile):
+    # Returns the metadata of a valid cache entry (touching it as recently used), or None if it's missing or stale
+    if not os.path.exists(npyFile) or not os.path.exists(jsonFile): return None
+    with open(jsonFile, 'r') as f:
+        meta = json.load(f)
+    stamp = getFileStamp(source)
+    if stamp!=meta['sourceStamp']:
+        # the source has been touched, it's still valid if the content is the same
+        if hashing.fileHash(source)!=meta['sourceHash']: return None
+        meta['sourceStamp'] = stamp
+        saveSidecar(meta, jsonFile)
+    else: os.utime(jsonFile, None)
+    return meta
+
+def saveAtomic(fileName, save, mode='wb'):
+    # Writes a file through a temporary file that is renamed at the end, so parallel jobs never read a partial file
+    # (save writes the content into the opened temporary file, the folder is created if needed)
+    folder = os.path.dirname(fileName)
+    if folder and not os.path.isdir(folder): os.makedirs(folder)
+    tmpFile = fileName+'.{0}.tmp'.format(os.getpid())
+    try:
+        with open(tmpFile, mode) as f:
+            save(f)
+    except:
+        if os.path.exists(tmpFile): os.remove(tmpFile)
+        raise
+    if os.path.exists(fileName): os.remove(fileName)
+    os.rename(tmpFile, fileName)
+
+def saveSidecar(meta, jsonFile):
+    saveAtomic(jsonFile, lambda f: json.dump(meta, f), 'w')
+
+def isCached(fileName):
+    # True if a file of the cache exists, it's touched as recently used (see evict)
+    if not os.path.exists(fileName): return False
+    os.utime(fileName, None)
+    return True
+
+def openEntry(npyFile, meta):
+    # memory-mapped read-only data of an entry, cells with the NODATA/fill value are masked
+    data = numpy.load(npyFile, mmap_mode='r')
+    return numpy.ma.masked_equal(data, numpy.asarray(meta['NODATA_value'], dtype=data.dtype)[()], copy=False)
+
+def evict(cacheDir=GRID_CACHE_DIR, maxSize=GRID_CACHE_SIZE, keep=()):
+    # Removes the stale temporary files and the least recently used entries (every file of a key) until the cache is
+    # not bigger than maxSize, the entries of the files in keep and the temporary files of running writes are never removed
+    if not os.path.isdir(cacheDir): return
+    keep = set(os.path.abspath(fileName) for fileName in keep)
+    entries = dict()
+    total = 0
+    for name in os.listdir(cacheDir):
+        match = CACHE_FILE.match(name)
+        if match is None: continue
+        fileName = os.path.join(cacheDir, name)
+        try:
+            stat = os.stat(fileName)
+        except OSError:
+            # removed by another process in the meantime
+            continue
+        if TEMPORARY_FILE.search(name):
+            if STALE_TEMPORARY_AGE<time.time()-stat.st_mtime: removeFile(fileName)
+            else: total += stat.st_size
+            continue
+        lastUsed, files, size = entries.get(match.group(1), (0, [], 0))
+        entries[match.group(1)] = (max(lastUsed, stat.st_mtime), files+[fileName], size+stat.st_size)
+        total += stat.st_size
+    for lastUsed, files, size in sorted(entries.values()):
+        if total<=maxSize: break
+        if keep.intersection(os.path.abspath(fileName) for fileName in files): continue
+        for fileName in files: removeFile(fileName)
+        total -= size
+
+def removeFile(fileName):
+    # removes a file of the cache, unless another process has already removed it
+    try:
+        os.remove(fileName)
+    except OSError:
+        if os.path.exists(fileName): raise
+
+def iterAsciiBands(asciiGzFile, dtype, bandRows=sedac_ascii.BAND_ROWS, cacheDir=GRID_CACHE_DIR, maxSize=GRID_CACHE_SIZE):
+    # Same as sedac_ascii.iterAsciiBands, but the bands are read from the memory-mapped cache if the file has been parsed before,
+    # otherwise they are parsed and written into the cache at the same time (the bands are read-only)
+    npyFile, jsonFile = getEntryFiles(cacheDir, asciiGzFile, 'ascii', str(numpy.dtype(dtype)))
+    meta = loadSidecar(asciiGzFile, npyFile, jsonFile)
+    if meta is not None:
+        data = numpy.load(npyFile, mmap_mode='r')
+        for firstRow in range(0, data.shape[0], bandRows):
+            yield firstRow, data[firstRow:firstRow+bandRows,:]
+        return
+    header = sedac_ascii.readAsciiHeader(asciiGzFile)
+    if not os.path.isdir(cacheDir): os.makedirs(cacheDir)
+    tmpFile = npyFile[:-4]+'.{0}.tmp.npy'.format(os.getpid())
+    data = numpy.lib.format.open_memmap(tmpFile, mode='w+', dtype=dtype, shape=(header.nrows, header.ncols))
+    completed = False
+    try:
+        for firstRow, band in sedac_ascii.iterAsciiBands(asciiGzFile, dtype, bandRows):
+            data[firstRow:firstRow+band.shape[0],:] = band
+            yield firstRow, band
+        data.flush()
+        completed = True
+    finally:
+        del data
+        # the entry is only created if the whole file has been read
+        if not completed and os.path.exists(tmpFile): os.remove(tmpFile)
+    os.rename(tmpFile, npyFile)
+    saveSidecar({'source': os.path.abspath(asciiGzFile), 'sourceHash': hashing.fileHash(asciiGzFile), 'sourceStamp': getFileStamp(asciiGzFile),
+                 'header': list(header), 'NODATA_value': header.NODATA_value}, jsonFile)
+    evict(cacheDir, maxSize, keep=(npyFile,))
+
+def openAsciiGrid(asciiGzFile, dtype, cacheDir=GRID_CACHE_DIR, maxSize=GRID_CACHE_SIZE):
+    # Returns the header and the memory-mapped, masked grid of a SEDAC ascii file (parsing it into the cache if needed)
+    npyFile, jsonFile = getEntryFiles(cacheDir, asciiGzFile, 'ascii', str(numpy.dtype(dtype)))
+    meta = loadSidecar(asciiGzFile, npyFile, jsonFile)
+    if meta is None:
+        for firstRow, band in iterAsciiBands(asciiGzFile, dtype, cacheDir=cacheDir, maxSize=maxSize): pass
+        meta = loadSidecar(asciiGzFile, npyFile, jsonFile)
+    return sedac_ascii.AsciiHeader(*meta['header']), openEntry(npyFile, meta)
+
+def getNcGridEntry(ncFile, var, cacheDir=GRID_CACHE_DIR, maxSize=GRID_CACHE_SIZE, keep=()):
+    # Returns the .npy file and the metadata of the cache entry of a (lat, lon) or (..., lat, lon) netCDF variable
+    # (copying the variable into the cache band by band if needed, the entries in keep, e.g. the other grids of the
+    # same run, aren't evicted to make room for it)
+    npyFile, jsonFile = getEntryFiles(cacheDir, ncFile, 'nc', var)
+    meta = loadSidecar(ncFile, npyFile, jsonFile)
+    if meta is None:
+        nc = netCDF4.Dataset(ncFile, 'r')
+        tmpFile = npyFile[:-4]+'.{0}.tmp.npy'.format(os.getpid())
+        try:
+            ncVar = nc.variables[var]
+            if len(ncVar.shape)<2: raise Exception('Invalid variable', var+' must have (..., lat, lon) dimensions.')
+            fill = ncVar.getncattr('_FillValue') if '_FillValue' in ncVar.ncattrs() else netCDF4.default_fillvals[ncVar.dtype.str[1:]]
+            if not os.path.isdir(cacheDir): os.makedirs(cacheDir)
+            data = numpy.lib.format.open_memmap(tmpFile, mode='w+', dtype=ncVar.dtype, shape=ncVar.shape)
+            for firstRow in range(0, ncVar.shape[-2], BAND_ROWS):
+                data[...,firstRow:firstRow+BAND_ROWS,:] = numpy.ma.filled(ncVar[...,firstRow:firstRow+BAND_ROWS,:], fill)
+            data.flush()
+            del data
+            meta = {'source': os.path.abspath(ncFile), 'sourceHash': hashing.fileHash(ncFile), 'sourceStamp': getFileStamp(ncFile),
+                    'variable': var, 'NODATA_value': numpy.asarray(fill).item(),
+                    'lat': nc.variables['lat'][:].tolist(), 'lon': nc.variables['lon'][:].tolist()}
+        except:
+            if os.path.exists(tmpFile): os.remove(tmpFile)
+            raise
+        finally:
+            nc.close()
+        os.rename(tmpFile, npyFile)
+        saveSidecar(meta, jsonFile)
+        evict(cacheDir, maxSize, keep=(npyFile,)+tuple(keep))
+    return npyFile, meta
+
+def openNcGrid(ncFile, var, cacheDir=GRID_CACHE_DIR, maxSize=GRID_CACHE_SIZE):
+    # Returns the memory-mapped, masked (lat, lon) or (..., lat, lon) variable and the lat, lon coordinates of a netCDF file
+    # (copying the variable into the cache band by band if needed)
+    npyFile, meta = getNcGridEntry(ncFile, var, cacheDir, maxSize)
+    return openEntry(npyFile, meta), numpy.array(meta['lat']), numpy.array(meta['lon'])
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+'''
+In-memory store of the SEDAC GPW v3 inputs and derived products for interactive sessions and worker processes
+
+The store knows the sources (the converted netCDF grids of every resolution, the country table and the UN population
+files), and builds every product lazily on the first request: the grids, land masks, cell areas, country tables,
+region mappings, country and region totals, point indexes and the population of any year (see population_epochs.py).
+The products are kept in a least recently used cache with a memory limit (SEDAC_STORE_MEMORY environment variable
+in MB, or the memoryLimit argument), so repeated aggregations and lookups of a notebook or a worker don't reload the
+same data. The keys of the products include the
+size and modification time of their source files, so a product is rebuilt if its sources have been changed.
+    store = grid_store.GridStore('results', 'gl_gpwv3_ntlbndid_ascii_25/bndsg.dbf', 'un_population')
+    countries, maxid = store.getCountries()
+    totPop = store.getRegionTotals('25', ['tests/regions.tsv'])
+    points = store.queryPoints('half', lats, lons)
+    totPop = store.getPopulationTotals('half', range(1990, 2016))
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import re
+import sys
+import csv
+import collections
+import numpy
+import dbf
+import grid_cache
+import sedac_nc
+import zonal
+import region_mapping
+import point_query
+import weight_index
+import population_epochs
+import instrumentation
+
+Country = collections.namedtuple('Country', 'name iso3v10 unsdcode sedaccode')
+UNData = collections.namedtuple('UNData', 'name unsdcode population')
+
+GRID_STORE_MEMORY = int(os.environ.get('SEDAC_STORE_MEMORY', 1024))*(1<<20)
+
+def loadCountries(dbfFile):
+    # dict of the ISO3 codes -> countries of bndsg.dbf, and the biggest sedaccode
+    table = dbf.Table(dbfFile)
+    table.open()
+    try:
+        maxid = 0
+        countries = dict()
+        for row in table:
+            countries[row.iso3v10] = Country(name=row.countryeng.strip().replace('\t', ' '), iso3v10=row.iso3v10, unsdcode=row.unsdcode, sedaccode=row.value)
+            maxid = max(maxid, row.value)
+    finally:
+        table.close()
+    return countries, maxid
+
+def loadUNPop(tsvFile, year=2000):
+    # dict of the UN country codes -> population of a UN population file (un_pop_<year>.tsv, in thousands)
+    countries = dict()
+    with open(tsvFile, 'rb') as fcsv:
+        reader = csv.reader(fcsv, delimiter='\t', quoting=csv.QUOTE_NONE)
+        rownum = 0
+        for row in reader:
+            rownum += 1
+            #check header rows
+            if 1==rownum:
+                if 'Country code'!=row[1] or str(year)!=row[2]: raise Exception('IO error', 'Invalid header in UN population file!.')
+            else:
+                countries[int(row[1])] = UNData(name=row[0], unsdcode=int(row[1]), population=float(row[2])*1000)
+    return countries
+
+def getSize(value):
+    # Estimated memory of a product in bytes: memory-mapped arrays don't count (only their masks), sparse matrices
+    # and k-d trees count with their arrays, containers with their items
+    if value is None: return 0
+    if isinstance(value, numpy.ma.MaskedArray):
+        return getSize(numpy.ma.getdata(value)) + (value.mask.nbytes if value.mask is not numpy.ma.nomask else 0)
+    if isinstance(value, numpy.memmap): return 0
+    if isinstance(value, numpy.ndarray):
+        if value.dtype==object: return value.nbytes + sum(sys.getsizeof(item) for item in value.flat)
+        return value.nbytes
+    if isinstance(value, dict): return sys.getsizeof(value) + sum(getSize(k)+getSize(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)): return sys.getsizeof(value) + sum(getSize(item) for item in value)
+    arrays = [getattr(value, name) for name in ('data', 'indices', 'indptr', 'row', 'col') if isinstance(getattr(value, name, None), numpy.ndarray)]
+    if arrays: return sum(a.nbytes for a in arrays)
+    return sys.getsizeof(value)
+
+class LRUCache(object):
+    # Least recently used cache of products with a memory limit in bytes, products bigger than the limit aren't kept
+
+    def __init__(self, maxSize=GRID_STORE_MEMORY):
+        self.maxSize = maxSize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, build):
+        # Returns the product of the key, calling build() if it isn't in the cache
+        if key in self.entries:
+            self.hits += 1
+            entry = self.entries.pop(key)
+            self.entries[key] = entry
+            return entry[0]
+        self.misses += 1
+        value = build()
+        size = getSize(value)
+        if size<=self.maxSize:
+            self.entries[key] = (value, size)
+            self.size += size
+            self.evict()
+        return value
+
+    def evict(self):
+        while self.maxSize<self.size:
+            key, (value, size) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+class GridStore(object):
+    # Lazily built products of the SEDAC grids of a results folder (<var>_<resolution>.nc files, e.g. glbnds_half.nc,
+    # and the pcount_epochs_<resolution>.nc stacks), of the country table and of the UN population files of a folder (un_pop_<year>.tsv)
+
+    def __init__(self, resultsDir, dbfFile, unPopDir=None, memoryLimit=GRID_STORE_MEMORY, cacheDir=grid_cache.GRID_CACHE_DIR):
+        self.resultsDir = resultsDir
+        self.dbfFile = dbfFile
+        self.unPopDir = unPopDir
+        self.cacheDir = cacheDir
+        self.cache = LRUCache(memoryLimit)
+
+    def getGridFile(self, var, resolution):
+        return os.path.join(self.resultsDir, '{0}_{1}.nc'.format(var, resolution))
+
+    def getUNPopFile(self, year):
+        if self.unPopDir is None: raise Exception('IO error', 'The folder of the UN population files is not set.')
+        return os.path.join(self.unPopDir, 'un_pop_{0}.tsv'.format(year))
+
+    def getStackFile(self, resolution):
+        return os.path.join(self.resultsDir, 'pcount_epochs_{0}.nc'.format(resolution))
+
+    def getUNYears(self):
+        # years of the UN population files of the folder
+        if self.unPopDir is None: return []
+        return sorted(int(match.group(1)) for match in (re.match(r'un_pop_(\d+)\.tsv$', f) for f in os.listdir(self.unPopDir)) if match)
+
+    def product(self, name, sources, build, *args):
+        # Returns a product from the cache or builds it with build(*args) - the key is the name, the arguments and the
+        # size and modification time of the source files
+        key = (name,) + args + tuple(tuple(grid_cache.getFileStamp(source)) for source in sources)
+        def timedBuild():
+            with instrumentation.stage('store/'+name, bytesRead=sum(instrumentation.fileSize(source) for source in sources)):
+                return build(*args)
+        return self.cache.get(key, timedBuild)
+
+    def getCountries(self):
+        # dict of the ISO3 codes -> countries, and the biggest sedaccode
+        return self.product('countries', [self.dbfFile], loadCountries, self.dbfFile)
+
+    def getCountryIds(self):
+        # dict of the ISO3 codes -> sedaccodes
+        def build():
+            countries, maxid = self.getCountries()
+            return dict((code.strip(), country.sedaccode) for code, country in countries.items())
+        return self.product('countryIds', [self.dbfFile], build)
+
+    def getCountryCodes(self):
+        # array of the ISO3 codes whose index is the sedaccode
+        return self.product('countryCodes', [self.dbfFile], point_query.loadCountryCodes, self.dbfFile)
+
+    def getUNPop(self, year=2000):
+        unPopFile = self.getUNPopFile(year)
+        return self.product('unPop', [unPopFile], loadUNPop, unPopFile, year)
+
+    def getGrid(self, var, resolution):
+        # memory-mapped, masked (lat, lon) grid and its lat, lon coordinates (through the grid cache)
+        ncFile = self.getGridFile(var, resolution)
+        return self.product('grid', [ncFile], grid_cache.openNcGrid, ncFile, var, self.cacheDir)
+
+    def getGrids(self, resolution):
+        # co-registered glbnds and pcount grids of a resolution and their lat, lon coordinates
+        glbnds, latsG, lonsG = self.getGrid('glbnds', resolution)
+        pcount, latsP, lonsP = self.getGrid('pcount', resolution)
+        sedac_nc.checkSameGrid(latsG, lonsG, latsP, lonsP)
+        return glbnds, pcount, latsG, lonsG
+
+    def getLandMask(self, resolution):
+        # grid of the land (not masked) cells of glbnds
+        ncFile = self.getGridFile('glbnds', resolution)
+        return self.product('landMask', [ncFile], lambda resolution: ~numpy.ma.getmaskarray(self.getGrid('glbnds', resolution)[0]), resolution)
+
+    def getCellAreas(self, resolution):
+        # area of the cells of every row of the grid in km2
+        ncFile = self.getGridFile('glbnds', resolution)
+        return self.product('cellAreas', [ncFile], lambda resolution: weight_index.getRowAreas(self.getGrid('glbnds', resolution)[1]), resolution)
+
+    def getRegionMapping(self, regionFiles):
+        # region mapping of the region sets of the region files (list of files, or an ordered dict of set names -> files)
+        if not isinstance(regionFiles, dict): regionFiles = collections.OrderedDict((os.path.splitext(os.path.basename(f))[0], f) for f in regionFiles)
+        regionFiles = tuple((setName, os.path.abspath(tsvFile)) for setName, tsvFile in regionFiles.items())
+        def build(regionFiles):
+            countries, maxid = self.getCountries()
+            return region_mapping.createRegionMapping(region_mapping.loadRegionSets(collections.OrderedDict(regionFiles)), self.getCountryIds(), maxid+1)
+        return self.product('regionMapping', [self.dbfFile]+[tsvFile for setName, tsvFile in regionFiles], build, regionFiles)
+
+    def getCountryTotals(self, resolution):
+        # total population of every sedaccode
+        def build(resolution):
+            glbnds, pcount, lats, lons = self.getGrids(resolution)
+            countries, maxid = self.getCountries()
+            return zonal.zonalSums(glbnds, pcount, maxid+1)
+        return self.product('countryTotals', [self.getGridFile(var, resolution) for var in ('glbnds', 'pcount')]+[self.dbfFile], build, resolution)
+
+    def getRegionTotals(self, resolution, regionFiles):
+        # total population of the regions of every set of the region files (in the order of mapping.names)
+        return self.getRegionMapping(regionFiles).membership.dot(self.getCountryTotals(resolution))
+
+    def getPointIndex(self, resolution, nearestLand=False):
+        def build(resolution, nearestLand):
+            glbnds, pcount, lats, lons = self.getGrids(resolution)
+            return point_query.buildPointIndex(glbnds, lats, lons, pcount, self.getCountryCodes(), nearestLand=nearestLand)
+        return self.product('pointIndex', [self.getGridFile(var, resolution) for var in ('glbnds', 'pcount')]+[self.dbfFile], build, resolution, nearestLand)
+
+    def queryPoints(self, resolution, lats, lons, maxDistance=None):
+        # country and population of the cells of the points (see point_query.queryPoints)
+        return point_query.queryPoints(self.getPointIndex(resolution, maxDistance is not None), lats, lons, maxDistance)
+
+    def getPopulationStack(self, resolution):
+        # memory-mapped (year, lat, lon) stack of the population epochs
+        stackFile = self.getStackFile(resolution)
+        return self.product('populationStack', [stackFile], population_epochs.loadPopulationStack, stackFile, 'pcount', self.cacheDir)
+
+    def getUNCodes(self):
+        # UN code of every sedaccode
+        def build():
+            countries, maxid = self.getCountries()
+            return population_epochs.getUNCodes(countries, maxid+1)
+        return self.product('unCodes', [self.dbfFile], build)
+
+    def getEpochTotals(self, resolution, years, method='linear'):
+        # [years x sedaccodes] gridded total population of the countries interpolated to the years
+        years = tuple(numpy.atleast_1d(years).tolist())
+        def build(resolution, years, method):
+            glbnds, lats, lons = self.getGrid('glbnds', resolution)
+            countries, maxid = self.getCountries()
+            return population_epochs.aggregatePopulation(self.getPopulationStack(resolution), glbnds, years, maxid+1, method=method)
+        sources = [self.getGridFile('glbnds', resolution), self.getStackFile(resolution), self.dbfFile]
+        return self.product('epochTotals', sources, build, resolution, years, method)
+
+    def getUNFactors(self, resolution, years, method='linear'):
+        # [years x sedaccodes] factors that rescale the gridded population of the countries to the UN totals
+        # (interpolated between the years of the UN files, 1 if there's no UN file)
+        years = tuple(numpy.atleast_1d(years).tolist())
+        unYears = self.getUNYears()
+        def build(resolution, years, method):
+            unPops = dict((unYear, self.getUNPop(unYear)) for unYear in unYears)
+            unYearTotals = self.getEpochTotals(resolution, unYears, method) if unYears else None
+            return population_epochs.getUNFactors(unYearTotals, self.getUNCodes(), unPops, years)
+        sources = [self.getGridFile('glbnds', resolution), self.getStackFile(resolution), self.dbfFile] + [self.getUNPopFile(unYear) for unYear in unYears]
+        return self.product('unFactors', sources, build, resolution, years, method)
+
+    def getPopulationTotals(self, resolution, years, regionFiles=None, unRescale=True, method='linear'):
+        # [years x sedaccodes] total population of the countries in the years (rescaled to the UN totals),
+        # or [years x regions] total population of the regions of the region files
+        totals = self.getEpochTotals(resolution, years, method)
+        if unRescale: totals = totals*self.getUNFactors(resolution, years, method)
+        if regionFiles is None: return totals
+        return self.getRegionMapping(regionFiles).membership.dot(totals.T).T
+
+    def getPopulationGrid(self, resolution, year, unRescale=True, method='linear'):
+        # masked (lat, lon) population grid of a year (rescaled to the UN totals), e.g. for the weights of climate indexes
+        def build(resolution, year, unRescale, method):
+            glbnds, lats, lons = self.getGrid('glbnds', resolution)
+            factors = self.getUNFactors(resolution, [year], method) if unRescale else None
+            return population_epochs.getPopulationGrid(self.getPopulationStack(resolution), year, glbnds, factors, method)
+        sources = [self.getGridFile('glbnds', resolution), self.getStackFile(resolution), self.dbfFile]
+        return self.product('populationGrid', sources, build, resolution, year, unRescale, method)
+
+    def clear(self):
+        self.cache.clear()
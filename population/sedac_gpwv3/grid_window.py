@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+'''
+Windowed (bounding box or region extent) reads of the SEDAC GPW v3 netCDF grids
+
+A window is a rectangle of rows and columns of the global grid, it's read with one hyperslab read (two if it
+crosses the antimeridian) from the glbnds, pcount or any co-registered (..., lat, lon) variable, so regional jobs
+only read the chunks they need. Windows can be created from a lat/lon bounding box, or from the extent of a set of
+countries, which is taken from the row and column occupancy of the countries (cached on disk for every glbnds file).
+    extents = grid_window.getCountryExtents('results/glbnds_25.nc')
+    window = grid_window.getCountryWindow(extents, [countryIds['FRA'], countryIds['DEU']])
+    totPop = grid_window.windowZonalSums('results/glbnds_25.nc', 'results/pcount_25.nc', window, maxid+1)
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import math
+import collections
+import netCDF4
+import numpy
+import hashing
+import grid_cache
+import sedac_nc
+import zonal
+
+# rows and columns of the window in the global grid, colStop can be bigger than the number of columns if the window
+# crosses the antimeridian (the columns are wrapped around)
+Window = collections.namedtuple('Window', 'rowStart rowStop colStart colStop')
+# rows, cols: [country ids x rows] and [country ids x columns] arrays of the rows and columns where a country has cells
+CountryExtents = collections.namedtuple('CountryExtents', 'rows cols')
+
+# number of rows read at once when the country extents are built
+BAND_ROWS = 240
+
+def getBboxWindow(lats, lons, south, north, west, east):
+    # Window of the cells that intersect a lat/lon bounding box of a regular global grid with decreasing latitudes
+    # (west>east means that the box crosses the antimeridian)
+    if north<=south: raise Exception('Invalid bounding box', 'north must be bigger than south.')
+    gridSize = abs(float(lats[1]-lats[0])) if 1<len(lats) else 180.0
+    top, left = float(lats[0])+gridSize/2, float(lons[0])-gridSize/2
+    rowStart = max(0, int(math.floor((top-north)/gridSize)))
+    rowStop = min(len(lats), int(math.ceil((top-south)/gridSize)))
+    width = (east-west) % 360.0 or 360.0
+    colStart = int(math.floor(((west-left) % 360.0)/gridSize))
+    colStop = min(colStart+len(lons), int(math.ceil(((west-left) % 360.0 + width)/gridSize)))
+    return Window(rowStart=rowStart, rowStop=max(rowStart, rowStop), colStart=colStart, colStop=colStop)
+
+def buildCountryExtents(glbnds, size=None, bandRows=BAND_ROWS):
+    # Row and column occupancy of the countries of an id grid (a netCDF variable or an array), read band by band
+    # (size is the number of country ids, maxid+1 by default)
+    nrows, ncols = glbnds.shape
+    rowPairs, colPairs = list(), list()
+    for firstRow in range(0, nrows, bandRows):
+        band = numpy.ma.asarray(glbnds[firstRow:firstRow+bandRows,:])
+        r, c = numpy.nonzero(~numpy.ma.getmaskarray(band) & (0<=numpy.ma.getdata(band)))
+        ids = numpy.ma.getdata(band)[r, c].astype('int64')
+        # unique (id, row) and (id, col) pairs of the band
+        rowPairs.append(numpy.unique(ids*nrows + firstRow+r))
+        colPairs.append(numpy.unique(ids*ncols + c))
+    rowPairs, colPairs = numpy.concatenate(rowPairs), numpy.unique(numpy.concatenate(colPairs))
+    if size is None: size = int(rowPairs.max())//nrows+1 if rowPairs.size else 0
+    rowPairs, colPairs = rowPairs[rowPairs<size*nrows], colPairs[colPairs<size*ncols]
+    rows = numpy.zeros([size, nrows], dtype=bool)
+    cols = numpy.zeros([size, ncols], dtype=bool)
+    rows[rowPairs//nrows, rowPairs%nrows] = True
+    cols[colPairs//ncols, colPairs%ncols] = True
+    return CountryExtents(rows=rows, cols=cols)
+
+def getCountryExtents(glbndsFile, cacheDir=grid_cache.GRID_CACHE_DIR):
+    # Returns the country extents of a glbnds file, they're built only if they aren't in the cache yet
+    # (the extents are stored in the grid cache folder)
+    npzFile = os.path.join(cacheDir, 'extents_'+hashing.fileHash(glbndsFile)+'.npz')
+    if grid_cache.isCached(npzFile):
+        with numpy.load(npzFile) as f:
+            return CountryExtents(rows=f['rows'], cols=f['cols'])
+    nc = netCDF4.Dataset(glbndsFile, 'r')
+    try:
+        extents = buildCountryExtents(nc.variables['glbnds'])
+    finally:
+        nc.close()
+    grid_cache.saveAtomic(npzFile, lambda f: numpy.savez_compressed(f, rows=extents.rows, cols=extents.cols))
+    grid_cache.evict(cacheDir, keep=(npzFile,))
+    return extents
+
+def getCountryWindow(extents, countryIds):
+    # Smallest window that contains every cell of the countries, the columns can wrap around the antimeridian
+    # (the window doesn't include the longest run of empty columns) - None if the countries have no cells
+    countryIds = [i for i in countryIds if 0<=i<extents.rows.shape[0]]
+    rows = extents.rows[countryIds,:].any(axis=0)
+    cols = extents.cols[countryIds,:].any(axis=0)
+    if not rows.any(): return None
+    occupied = numpy.flatnonzero(cols)
+    # gaps between the occupied columns (the last one wraps around), the window starts after the biggest gap
+    gaps = numpy.diff(numpy.append(occupied, occupied[0]+cols.size))
+    biggest = numpy.argmax(gaps)
+    colStart = occupied[(biggest+1) % occupied.size]
+    colStop = occupied[biggest]+1
+    if colStop<=colStart: colStop += cols.size
+    occupiedRows = numpy.flatnonzero(rows)
+    return Window(rowStart=int(occupiedRows[0]), rowStop=int(occupiedRows[-1])+1, colStart=int(colStart), colStop=int(colStop))
+
+def readWindow(ncFile, var, window):
+    # Reads the window of a (..., lat, lon) variable (masked array) and the lat, lon coordinates of the window
+    # (the longitudes are increased by 360 after the antimeridian)
+    nc = netCDF4.Dataset(ncFile, 'r')
+    try:
+        ncVar = nc.variables[var]
+        lats = nc.variables[ncVar.dimensions[-2]][window.rowStart:window.rowStop]
+        lonVar = nc.variables[ncVar.dimensions[-1]]
+        ncols = lonVar.shape[0]
+        lead = (slice(None),)*(len(ncVar.shape)-2)
+        rows = slice(window.rowStart, window.rowStop)
+        data = numpy.ma.asarray(ncVar[lead+(rows, slice(window.colStart, min(window.colStop, ncols)))])
+        lons = lonVar[window.colStart:min(window.colStop, ncols)]
+        if ncols<window.colStop:
+            data = numpy.ma.concatenate([data, numpy.ma.asarray(ncVar[lead+(rows, slice(0, window.colStop-ncols))])], axis=-1)
+            lons = numpy.concatenate([lons, lonVar[0:window.colStop-ncols]+360.0])
+        return data, lats, lons
+    finally:
+        nc.close()
+
+def windowZonalSums(glbndsFile, pcountFile, window, size, mapping=None):
+    # Total population of the zones (see zonal.zonalSums) calculated only from the cells of the window
+    glbnds, latsG, lonsG = readWindow(glbndsFile, 'glbnds', window)
+    pcount, latsP, lonsP = readWindow(pcountFile, 'pcount', window)
+    sedac_nc.checkSameGrid(latsG, lonsG, latsP, lonsP)
+    return zonal.zonalSums(glbnds, pcount, size, mapping)
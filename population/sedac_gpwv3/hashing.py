@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+'''
+Content hashes of the input files and arrays, used as keys of the cached products
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import hashlib
+import numpy
+
+CHUNK_SIZE = 1<<20
+
+def fileHash(fileName):
+    # sha1 hex digest of the content of a file
+    h = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        chunk = f.read(CHUNK_SIZE)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(CHUNK_SIZE)
+    return h.hexdigest()
+
+def combinedHash(*items):
+    # sha1 hex digest of a list of strings, numbers and numpy arrays (e.g. file hashes and parameters)
+    h = hashlib.sha1()
+    for item in items:
+        if isinstance(item, numpy.ndarray):
+            h.update(str(item.dtype).encode('ascii'))
+            h.update(str(item.shape).encode('ascii'))
+            h.update(numpy.ascontiguousarray(item).tobytes())
+        else:
+            h.update(repr(item).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
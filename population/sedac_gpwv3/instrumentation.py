@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+'''
+Stage timing and throughput instrumentation of the SEDAC GPW v3 scripts
+
+A stage is a named piece of work (e.g. 'glbnds/parse'), its wall and CPU time is measured every time it is entered
+(with stage: ...), the processed cells and the bytes read and written are counted, and when the stage is reported the
+record is sent to every sink together with the peak RSS of the process:
+    with instrumentation.stage('getTotalPopulation', cells=glbnds.size):
+        ...
+    parse = instrumentation.Stage('glbnds/parse')
+    for firstRow, band in instrumentation.timedIter(bands, parse): ...
+    parse.report()
+The default sink writes a human readable line to stdout, records can also be written to a json lines file
+(SEDAC_METRICS_JSON environment variable or addSink(JsonLinesSink(fileName))). The top level stages can be
+profiled with cProfile, the stats are dumped into a folder (SEDAC_PROFILE_DIR environment variable or setProfiler).
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import re
+import sys
+import json
+import time
+import socket
+import cProfile
+import datetime
+import contextlib
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class LogSink(object):
+    # human readable log lines
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, record):
+        stream = self.stream or sys.stdout
+        message = '[{0}]   {1}: {2:.3f}s wall, {3:.3f}s cpu'.format(record['time'], record['stage'], record['wall'], record['cpu'])
+        if record['cells']: message += ', {0:.3g} cells/s'.format(record['cellsPerSecond'])
+        if record['bytesRead']: message += ', {0:.1f}MB read'.format(record['bytesRead']/1048576.0)
+        if record['bytesWritten']: message += ', {0:.1f}MB written'.format(record['bytesWritten']/1048576.0)
+        if record['peakRssMB'] is not None: message += ', peak RSS {0:.0f}MB'.format(record['peakRssMB'])
+        stream.write(message+'\n')
+        stream.flush()
+
+class JsonLinesSink(object):
+    # one json record per reported stage appended to a file
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+    def write(self, record):
+        with open(self.fileName, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True)+'\n')
+
+sinks = [LogSink()]
+if os.environ.get('SEDAC_METRICS_JSON'): sinks.append(JsonLinesSink(os.environ['SEDAC_METRICS_JSON']))
+profileDir = os.environ.get('SEDAC_PROFILE_DIR')
+# number of stages entered at the moment (only the top level stages are profiled)
+activeStages = [0]
+
+def addSink(sink):
+    sinks.append(sink)
+
+def removeSink(sink):
+    sinks.remove(sink)
+
+def setProfiler(directory):
+    # the top level stages are profiled with cProfile and the stats are dumped into the directory (None switches it off)
+    global profileDir
+    profileDir = directory
+
+def getPeakRss():
+    # peak resident set size of the process in MB (ru_maxrss is in kilobytes on Linux and in bytes on macOS)
+    if resource is None: return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1048576.0 if 'darwin'==sys.platform else 1024.0)
+
+def getCpuTime():
+    times = os.times()
+    return times[0]+times[1]
+
+class Stage(object):
+    # a named stage whose measures are accumulated over every entering until it's reported
+    def __init__(self, name, cells=0, bytesRead=0, bytesWritten=0):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+        self.cells = cells
+        self.bytesRead = bytesRead
+        self.bytesWritten = bytesWritten
+        self.started = None
+        self.profiler = None
+
+    def __enter__(self):
+        if 0==activeStages[0] and profileDir is not None:
+            self.profiler = self.profiler or cProfile.Profile()
+            self.profiler.enable()
+        activeStages[0] += 1
+        self.started = (time.time(), getCpuTime())
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.wall += time.time()-self.started[0]
+        self.cpu += getCpuTime()-self.started[1]
+        self.calls += 1
+        activeStages[0] -= 1
+        if self.profiler is not None: self.profiler.disable()
+        return False
+
+    def count(self, cells=0, bytesRead=0, bytesWritten=0):
+        self.cells += cells
+        self.bytesRead += bytesRead
+        self.bytesWritten += bytesWritten
+
+    def report(self):
+        # sends the record of the stage to the sinks (and dumps the profiler stats)
+        record = {'stage': self.name, 'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'host': socket.gethostname(),
+                  'pid': os.getpid(), 'wall': self.wall, 'cpu': self.cpu, 'calls': self.calls, 'cells': self.cells,
+                  'cellsPerSecond': self.cells/self.wall if 0<self.wall else None,
+                  'bytesRead': self.bytesRead, 'bytesWritten': self.bytesWritten, 'peakRssMB': getPeakRss()}
+        if self.profiler is not None:
+            if not os.path.isdir(profileDir): os.makedirs(profileDir)
+            self.profiler.dump_stats(os.path.join(profileDir, '{0}.{1}.prof'.format(re.sub(r'[^\w.-]+', '_', self.name), os.getpid())))
+            self.profiler = None
+        for sink in sinks: sink.write(record)
+        return record
+
+@contextlib.contextmanager
+def stage(name, cells=0, bytesRead=0, bytesWritten=0):
+    # one-off stage that is reported when it's left
+    s = Stage(name, cells, bytesRead, bytesWritten)
+    with s:
+        yield s
+    s.report()
+
+def timedIter(iterable, s):
+    # yields the items of an iterable, the time spent in producing them is measured in the stage
+    iterator = iter(iterable)
+    while True:
+        with s:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+def fileSize(fileName):
+    return os.path.getsize(fileName) if os.path.exists(fileName) else 0
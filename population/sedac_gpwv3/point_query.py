@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+'''
+Batched lat/lon point queries over the SEDAC GPW v3 grids
+
+Resolves arrays of coordinates (e.g. weather stations or asset locations) in one vectorized call to grid cells,
+SEDAC country ids, ISO3 codes (from bndsg.dbf), regions (with a country -> region mapping) and population counts.
+The grids are opened memory-mapped through the grid cache, so only the pages of the queried cells are read.
+Points on sea cells (e.g. coastal stations) can be moved to the nearest land cell within a distance limit,
+the nearest cells are searched in a k-d tree of the coastal land cells.
+
+Usage:
+    python point_query.py --glbnds results/glbnds_25.nc --pcount results/pcount_25.nc --dbf gl_gpwv3_ntlbndid_ascii_25/bndsg.dbf
+                          --points stations.tsv --output stations_countries.tsv --nearest-land 25
+--nearest-land without a distance uses the default distance limit (NEAREST_LAND_DISTANCE).
+The points file is a tab separated table with a header row that has lat and lon columns, the results are appended as new columns.
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import argparse
+import collections
+import numpy
+import scipy.spatial
+import dbf
+import grid_cache
+import sedac_nc
+import weight_index
+
+# glbnds, pcount: masked (lat, lon) grids (pcount can be None), lats, lons: cell center coordinates (latitudes in decreasing order),
+# iso3: ISO3 code of every country id ('' if unknown), mapping: region index of every country id (None if there are no regions),
+# coast: flat index of the coastal land cells and their k-d tree for the nearest land search (None if it's not needed)
+PointIndex = collections.namedtuple('PointIndex', 'glbnds pcount lats lons iso3 mapping coastCells coastTree')
+# rows, cols: grid cell of the points (-1 outside the grid), ids: SEDAC country ids (-1 on sea or outside the grid),
+# iso3: ISO3 codes, regions: region indexes (-1 if none), population: population count of the cells (nan if unknown),
+# moved: True where the point was moved to the nearest land cell
+PointResult = collections.namedtuple('PointResult', 'rows cols ids iso3 regions population moved')
+
+# default distance limit of the nearest land search in km
+NEAREST_LAND_DISTANCE = 25.0
+
+def loadCountryCodes(dbfFile):
+    # Returns an array of the ISO3 codes whose index is the sedaccode of the country ('' for unused ids)
+    table = dbf.Table(dbfFile)
+    table.open()
+    try:
+        countries = [(row.value, row.iso3v10.strip()) for row in table]
+    finally:
+        table.close()
+    iso3 = numpy.empty([max(value for value, code in countries)+1], dtype='object')
+    iso3[:] = ''
+    for value, code in countries: iso3[value] = code
+    return iso3
+
+def toUnitVectors(lats, lons):
+    # 3D unit vectors of points on the sphere, euclidean distances between them are chord lengths
+    lats, lons = numpy.radians(lats), numpy.radians(lons)
+    return numpy.column_stack([numpy.cos(lats)*numpy.cos(lons), numpy.cos(lats)*numpy.sin(lons), numpy.sin(lats)])
+
+def getCoastCells(glbnds):
+    # flat index of the land cells that have a sea (masked) neighbour (the grid is periodic in longitude)
+    sea = numpy.ma.getmaskarray(glbnds)
+    neighbourSea = numpy.zeros(sea.shape, dtype='bool')
+    neighbourSea[1:,:] |= sea[:-1,:]
+    neighbourSea[:-1,:] |= sea[1:,:]
+    neighbourSea |= numpy.roll(sea, 1, axis=1) | numpy.roll(sea, -1, axis=1)
+    return numpy.flatnonzero(neighbourSea & ~sea)
+
+def buildPointIndex(glbnds, lats, lons, pcount=None, iso3=None, mapping=None, nearestLand=False):
+    # Creates the point index of co-registered grids, the k-d tree of the coastal cells is built only if nearestLand is set
+    if iso3 is None: iso3 = numpy.empty([0], dtype='object')
+    coastCells, coastTree = None, None
+    if nearestLand:
+        coastCells = getCoastCells(glbnds)
+        coastTree = scipy.spatial.cKDTree(toUnitVectors(lats[coastCells//lons.size], lons[coastCells%lons.size]))
+    return PointIndex(glbnds=glbnds, pcount=pcount, lats=numpy.asarray(lats), lons=numpy.asarray(lons), iso3=iso3,
+                      mapping=None if mapping is None else numpy.asarray(mapping), coastCells=coastCells, coastTree=coastTree)
+
+def loadPointIndex(glbndsFile, pcountFile=None, dbfFile=None, mapping=None, nearestLand=False, cacheDir=grid_cache.GRID_CACHE_DIR):
+    # Creates the point index of netCDF grid files (opened through the memory-mapped grid cache)
+    glbnds, lats, lons = grid_cache.openNcGrid(glbndsFile, 'glbnds', cacheDir)
+    pcount = None
+    if pcountFile is not None:
+        pcount, latsP, lonsP = grid_cache.openNcGrid(pcountFile, 'pcount', cacheDir)
+        sedac_nc.checkSameGrid(lats, lons, latsP, lonsP)
+    iso3 = None if dbfFile is None else loadCountryCodes(dbfFile)
+    return buildPointIndex(glbnds, lats, lons, pcount, iso3, mapping, nearestLand)
+
+def getGridCells(index, lats, lons):
+    # row and column of the cells that contain the points (-1 for invalid coordinates),
+    # the grid is regular with decreasing latitudes and longitudes are wrapped around
+    lats = numpy.asarray(lats, dtype='float64')
+    lons = numpy.asarray(lons, dtype='float64')
+    nrows, ncols = index.glbnds.shape
+    gridSize = abs(float(index.lats[1]-index.lats[0])) if 1<nrows else 180.0
+    valid = numpy.isfinite(lats) & numpy.isfinite(lons) & (numpy.abs(lats)<=90)
+    with numpy.errstate(invalid='ignore'):
+        rows = numpy.clip(numpy.floor((index.lats[0]+gridSize/2-lats)/gridSize), 0, nrows-1)
+        cols = numpy.floor((lons-(index.lons[0]-gridSize/2))/gridSize) % ncols
+    rows = numpy.where(valid, rows, -1).astype('int64')
+    cols = numpy.where(valid, cols, -1).astype('int64')
+    return rows, cols
+
+def moveToNearestLand(index, rows, cols, lats, lons, maxDistance):
+    # moves the points of sea cells to the nearest coastal land cell within maxDistance km, returns where they've been moved
+    if index.coastTree is None: raise Exception('Invalid index', 'The point index has been created without the nearest land search.')
+    nrows, ncols = index.glbnds.shape
+    valid = 0<=rows
+    sea = numpy.zeros(rows.shape, dtype='bool')
+    sea[valid] = numpy.ma.getmaskarray(index.glbnds[rows[valid], cols[valid]])
+    moved = numpy.zeros(rows.shape, dtype='bool')
+    if not sea.any() or 0==index.coastCells.size: return moved
+    chord = 2*numpy.sin(min(numpy.pi, maxDistance/weight_index.EARTH_RADIUS)/2)
+    distances, nearest = index.coastTree.query(toUnitVectors(lats[sea], lons[sea]), distance_upper_bound=chord)
+    found = numpy.isfinite(distances)
+    cells = index.coastCells[nearest[found]]
+    seaPoints = numpy.flatnonzero(sea)[found]
+    rows[seaPoints], cols[seaPoints] = cells//ncols, cells%ncols
+    moved[seaPoints] = True
+    return moved
+
+def queryPoints(index, lats, lons, maxDistance=None):
+    # Resolves the points in one vectorized pass, the points of sea cells are moved to the nearest land cell
+    # if maxDistance (km) is given (the index has to be created with nearestLand)
+    lats = numpy.atleast_1d(numpy.asarray(lats, dtype='float64'))
+    lons = numpy.atleast_1d(numpy.asarray(lons, dtype='float64'))
+    rows, cols = getGridCells(index, lats, lons)
+    if maxDistance is None: moved = numpy.zeros(rows.shape, dtype='bool')
+    else: moved = moveToNearestLand(index, rows, cols, lats, lons, maxDistance)
+    valid = 0<=rows
+    # country ids, masked (sea) cells get -1
+    ids = numpy.empty(rows.shape, dtype='int64')
+    ids[:] = -1
+    values = index.glbnds[rows[valid], cols[valid]]
+    ids[valid] = numpy.ma.filled(values, -1)
+    known = (0<=ids) & (ids<index.iso3.size)
+    iso3 = numpy.empty(rows.shape, dtype='object')
+    iso3[:] = ''
+    iso3[known] = index.iso3[ids[known]]
+    regions = numpy.empty(rows.shape, dtype='int64')
+    regions[:] = -1
+    if index.mapping is not None:
+        mapped = (0<=ids) & (ids<index.mapping.size)
+        regions[mapped] = index.mapping[ids[mapped]]
+        regions[regions<0] = -1
+    population = numpy.empty(rows.shape, dtype='float64')
+    population[:] = numpy.nan
+    if index.pcount is not None:
+        population[valid] = numpy.ma.filled(index.pcount[rows[valid], cols[valid]].astype('float64'), numpy.nan)
+    return PointResult(rows=rows, cols=cols, ids=ids, iso3=iso3, regions=regions, population=population, moved=moved)
+
+def loadPoints(tsvFile):
+    # header and rows of a tab separated points file, and the lat, lon columns as arrays
+    with open(tsvFile, 'r') as f:
+        header = f.readline().rstrip('\r\n').split('\t')
+        rows = [line.rstrip('\r\n').split('\t') for line in f if line.strip()]
+    if 'lat' not in header or 'lon' not in header: raise Exception('IO error', 'The points file must have lat and lon columns.')
+    lats = numpy.array([float(row[header.index('lat')]) for row in rows])
+    lons = numpy.array([float(row[header.index('lon')]) for row in rows])
+    return header, rows, lats, lons
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Resolves points to SEDAC GPW v3 countries and population cells.')
+    parser.add_argument('--glbnds', required=True, help='national identifier grid (glbnds_25.nc or glbnds_half.nc)')
+    parser.add_argument('--pcount', default=None, help='co-registered population count grid')
+    parser.add_argument('--dbf', default=None, help='country table with the ISO3 codes (bndsg.dbf)')
+    parser.add_argument('--points', required=True, help='tab separated points file with lat and lon columns')
+    parser.add_argument('--output', required=True, help='tab separated result file')
+    parser.add_argument('--nearest-land', type=float, nargs='?', default=None, const=NEAREST_LAND_DISTANCE, metavar='KM',
+                        help='move the points of sea cells to the nearest land cell within the given distance (default: {0:g} km)'.format(NEAREST_LAND_DISTANCE))
+    args = parser.parse_args()
+    index = loadPointIndex(args.glbnds, args.pcount, args.dbf, nearestLand=args.nearest_land is not None)
+    header, rows, lats, lons = loadPoints(args.points)
+    result = queryPoints(index, lats, lons, args.nearest_land)
+    with open(args.output, 'w') as f:
+        f.write('\t'.join(header+['sedaccode', 'iso3v10', 'pcount', 'moved'])+'\n')
+        for i in range(len(rows)):
+            f.write('\t'.join(rows[i]+[str(result.ids[i]), result.iso3[i], '{0}'.format(result.population[i]), str(int(result.moved[i]))])+'\n')
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+'''
+Population of any year from the (year, lat, lon) stack of the SEDAC GPW v3 population count epochs
+
+The stack is created by convert_pcount.convertSEDACpcountEpochs2nc (e.g. results/pcount_epochs_25.nc from the 1990, 1995
+and 2000 grids). The population of a cell in any year is interpolated between the two bracketing epochs (or extrapolated
+from the first or last two epochs) linearly or geometrically (constant growth rate), for any number of years at once.
+The gridded country totals can be rescaled to the UN totals: the ratio of the UN total and the gridded total of every
+country is calculated in the years of the UN population files (un_pop_<year>.tsv), interpolated linearly between them
+and held constant outside of them, and every cell of a country is multiplied with the ratio of the year (so the growth
+between the epochs is kept where there's no UN data, e.g. with a single UN file). The totals of every year are
+aggregated in one pass over the stack:
+    stack = population_epochs.loadPopulationStack('results/pcount_epochs_25.nc')
+    totals = population_epochs.aggregatePopulation(stack, glbnds, range(1990, 2016), maxid+1)
+    unTotals = population_epochs.aggregatePopulation(stack, glbnds, sorted(unPops.keys()), maxid+1)
+    factors = population_epochs.getUNFactors(unTotals, population_epochs.getUNCodes(countries, maxid+1), unPops, range(1990, 2016))
+    totPop = totals*factors
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import collections
+import netCDF4
+import numpy
+import grid_cache
+import zonal
+
+# years: years of the epochs, data: memory-mapped (year, lat, lon) array, fill: fill value of the masked cells,
+# lats, lons: cell center coordinates
+PopulationStack = collections.namedtuple('PopulationStack', 'years data fill lats lons')
+# lower, upper: index of the epochs used for every target year, weight: weight of the upper epoch
+# (0 or 1 if the year is an epoch, outside [0, 1] when extrapolating)
+InterpolationWeights = collections.namedtuple('InterpolationWeights', 'lower upper weight')
+
+METHODS = ('linear', 'geometric')
+# number of (year, lat, lon) values interpolated at once
+BAND_CELLS = 1<<22
+
+def loadPopulationStack(ncFile, var='pcount', cacheDir=grid_cache.GRID_CACHE_DIR):
+    # Opens the stack of a netCDF file through the memory-mapped grid cache (copying it into the cache if needed)
+    npyFile, meta = grid_cache.getNcGridEntry(ncFile, var, cacheDir)
+    data = numpy.load(npyFile, mmap_mode='r')
+    if 3!=data.ndim: raise Exception('Invalid variable', var+' must have (year, lat, lon) dimensions.')
+    nc = netCDF4.Dataset(ncFile, 'r')
+    try:
+        years = numpy.ma.getdata(nc.variables['year'][:]).astype('float64')
+    finally:
+        nc.close()
+    if 1<years.size and not (0<numpy.diff(years)).all(): raise Exception('Invalid stack', 'The years of the epochs must be increasing.')
+    return PopulationStack(years=years, data=data, fill=numpy.asarray(meta['NODATA_value'], dtype=data.dtype)[()],
+                           lats=numpy.array(meta['lat']), lons=numpy.array(meta['lon']))
+
+def getInterpolationWeights(epochYears, years):
+    # Epochs and weights of the years: the bracketing epochs inside the range of the epochs, the first or last two
+    # epochs outside of it (with one epoch every year gets its values)
+    epochYears = numpy.asarray(epochYears, dtype='float64')
+    years = numpy.atleast_1d(numpy.asarray(years, dtype='float64'))
+    if epochYears.size<2:
+        zeros = numpy.zeros(years.shape, dtype='int')
+        return InterpolationWeights(lower=zeros, upper=zeros, weight=numpy.zeros(years.shape))
+    upper = numpy.clip(numpy.searchsorted(epochYears, years, 'right'), 1, epochYears.size-1)
+    lower = upper-1
+    weight = (years-epochYears[lower])/(epochYears[upper]-epochYears[lower])
+    return InterpolationWeights(lower=lower, upper=upper, weight=weight)
+
+def interpolate(lower, upper, weight, method='linear'):
+    # Values between (or beyond) the lower and upper values, weight is the weight of the upper values (broadcast)
+    # geometric interpolation keeps the growth rate, it falls back to linear where a value isn't positive
+    # the values of exact epochs (weight 0 or 1) are kept as they are, extrapolated values aren't negative
+    if method not in METHODS: raise Exception('Invalid method', method+' is not one of '+', '.join(METHODS)+'.')
+    with numpy.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        values = (1.0-weight)*lower + weight*upper
+        if 'geometric'==method:
+            growing = (0<lower) & (0<upper)
+            values = numpy.where(growing, lower*numpy.power(numpy.where(growing, upper/numpy.where(growing, lower, 1.0), 1.0), weight), values)
+        values = numpy.where(0==weight, lower, numpy.where(1==weight, upper, numpy.maximum(values, 0.0)))
+    return values
+
+def interpolateEpochs(epochValues, weights, method='linear'):
+    # [years x ...] values of the years from the [epochs x ...] values of the epochs
+    weight = weights.weight.reshape((-1,)+(1,)*(epochValues.ndim-1))
+    return interpolate(epochValues[weights.lower], epochValues[weights.upper], weight, method)
+
+def getBandRows(stack, years, bandCells=BAND_CELLS):
+    return max(1, bandCells//(max(numpy.atleast_1d(years).size, stack.years.size)*stack.data.shape[2]))
+
+def scaleCells(values, ids, factors):
+    # multiplies the [years x cells] values with the factors of the country ids of the cells (ids outside the factors aren't scaled)
+    scaled = (0<=ids) & (ids<factors.shape[1])
+    values[:,scaled] *= factors[:,ids[scaled]]
+
+def iterPopulationBands(stack, years, glbnds=None, factors=None, method='linear', bandCells=BAND_CELLS):
+    # Yields the first row and the masked [years x rows x lon] population of the years band by band, factors is a
+    # [years x country ids] array of scale factors (e.g. getUNFactors) of the cells of the countries of glbnds
+    # (cells of other ids aren't scaled), a cell is masked where it's masked in every epoch that is used
+    if factors is not None and glbnds is None: raise Exception('Invalid arguments', 'The glbnds grid is needed to scale the countries.')
+    weights = getInterpolationWeights(stack.years, years)
+    bandRows = getBandRows(stack, years, bandCells)
+    for firstRow in range(0, stack.data.shape[1], bandRows):
+        band = numpy.array(stack.data[:,firstRow:firstRow+bandRows,:])
+        mask = band==stack.fill
+        values = interpolateEpochs(numpy.where(mask, 0.0, band), weights, method)
+        if factors is not None:
+            ids = numpy.ma.asarray(glbnds[firstRow:firstRow+band.shape[1],:])
+            scaleCells(values, numpy.where(numpy.ma.getmaskarray(ids), -1, numpy.ma.getdata(ids)).astype('int64'), factors)
+        yield firstRow, numpy.ma.masked_where(mask[weights.lower] & mask[weights.upper], values, copy=False)
+
+def aggregatePopulation(stack, glbnds, years, size, mapping=None, factors=None, method='linear', bandCells=BAND_CELLS):
+    # [years x zones] total population of the zones (see zonal.zonalSums) in every year, in one pass over the stack
+    # (only the cells of the zones are interpolated)
+    if tuple(glbnds.shape)!=tuple(stack.data.shape[1:]): raise Exception('Different grids!', 'Shape {0} instead of {1}.'.format(glbnds.shape, stack.data.shape[1:]))
+    weights = getInterpolationWeights(stack.years, years)
+    nyears = weights.weight.size
+    # the zones of every year are offset, so all of them are summed with one bincount
+    offsets = (numpy.arange(nyears)*size)[:,numpy.newaxis]
+    totals = numpy.zeros([nyears*size])
+    bandRows = getBandRows(stack, years, bandCells)
+    for firstRow in range(0, stack.data.shape[1], bandRows):
+        ids = numpy.ma.asarray(glbnds[firstRow:firstRow+bandRows,:])
+        valid, zones = zonal.getZoneMask(ids, size, mapping)
+        cells = stack.data[:,firstRow:firstRow+bandRows,:][:,valid]
+        values = interpolateEpochs(numpy.where(cells==stack.fill, 0.0, cells), weights, method)
+        if factors is not None: scaleCells(values, numpy.ma.getdata(ids)[valid].astype('int64'), factors)
+        totals += numpy.bincount((zones+offsets).ravel(), weights=values.ravel(), minlength=nyears*size)
+    return totals.reshape(nyears, size)
+
+def getPopulationGrid(stack, year, glbnds=None, factors=None, method='linear'):
+    # masked (lat, lon) population grid of one year (factors is a [1 x country ids] array of the year, see iterPopulationBands)
+    grid = numpy.ma.empty(stack.data.shape[1:])
+    for firstRow, values in iterPopulationBands(stack, [year], glbnds, factors, method):
+        grid[firstRow:firstRow+values.shape[1],:] = values[0]
+    return grid
+
+def getUNCodes(countries, size):
+    # UN code of every country id (-1 if the id isn't in the country table), countries is a dict of countries
+    # with unsdcode and sedaccode (see grid_store.loadCountries)
+    codes = numpy.empty([size], dtype='int64')
+    codes[:] = -1
+    for country in countries.values():
+        if 0<=country.sedaccode<size and country.unsdcode: codes[country.sedaccode] = country.unsdcode
+    return codes
+
+def getUNFactors(unYearTotals, unCodes, unPops, years):
+    # [years x country ids] factors that rescale the gridded country totals to the UN totals, unYearTotals are the
+    # [UN years x country ids] gridded totals in the years of the UN files (in increasing order), unPops is a dict of
+    # the years of the UN files -> dict of UN codes -> UN data (see grid_store.loadUNPop), the countries of a UN code
+    # are rescaled together, the factors of the UN years are interpolated linearly between the UN years and held
+    # constant outside of them (factors are 1 where there's no UN data or no gridded population, or no UN file at all)
+    nyears = numpy.atleast_1d(years).size
+    unYears = sorted(unPops.keys())
+    if not unYears: return numpy.ones([nyears, len(unCodes)])
+    codes, inverse = numpy.unique(unCodes, return_inverse=True)
+    unTotals = numpy.array([[unPops[unYear][code].population if code in unPops[unYear] else numpy.nan for code in codes] for unYear in unYears])
+    offsets = (numpy.arange(len(unYears))*codes.size)[:,numpy.newaxis]
+    gridTotals = numpy.bincount((inverse[numpy.newaxis,:]+offsets).ravel(), weights=numpy.asarray(unYearTotals, dtype='float64').ravel(),
+                                minlength=len(unYears)*codes.size).reshape(len(unYears), codes.size)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        factors = unTotals/gridTotals
+    factors = numpy.where(numpy.isfinite(factors) & (0<gridTotals) & (0<=codes), factors, 1.0)
+    weights = getInterpolationWeights(unYears, years)
+    factors = interpolate(factors[weights.lower], factors[weights.upper], numpy.clip(weights.weight, 0.0, 1.0)[:,numpy.newaxis])
+    return factors[:,inverse]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+'''
+Country -> region mapping of any number of region sets (e.g. UN subregions, continents, business zones)
+
+A region set is a tab separated file, every row is a region: its name and the ISO3 codes of its countries
+(the format of tests/regions.tsv). A country can belong to any number of regions of a set (overlapping regions),
+and a region can include the regions of an earlier set by their qualified name (e.g. 'subregions:Eastern Africa'
+in the continents set). All the sets are compiled into one sparse [regions x country ids] membership matrix,
+so the results of every region set are calculated from the country totals of one aggregation pass:
+    mapping = region_mapping.createRegionMapping(region_mapping.loadRegionSets(['subregions.tsv', 'continents.tsv']), countryIds)
+    totPop = mapping.membership.dot(zonal.zonalSums(glbnds, pcount, mapping.membership.shape[1]))
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import collections
+import numpy
+import scipy.sparse
+import dbf
+
+# names: qualified names of the regions ('set:region'), index: dict of the qualified names -> row of the membership matrix,
+# sets: dict of the set names -> (first, last+1) rows of the regions of the set, membership: sparse [regions x country ids] matrix
+# of 1s where the country belongs to the region, unknown: codes of the region files that are not in the country table
+RegionMapping = collections.namedtuple('RegionMapping', 'names index sets membership unknown')
+
+SET_SEPARATOR = ':'
+
+def loadCountryIds(dbfFile):
+    # dict of the ISO3 codes -> sedaccodes of the countries of bndsg.dbf
+    table = dbf.Table(dbfFile)
+    table.open()
+    try:
+        return dict((row.iso3v10.strip(), row.value) for row in table)
+    finally:
+        table.close()
+
+def loadRegionFile(tsvFile):
+    # list of the (region name, list of codes) tuples of a region file
+    regions = list()
+    with open(tsvFile, 'r') as f:
+        for line in f:
+            row = [item.strip() for item in line.rstrip('\r\n').split('\t')]
+            if row[0]: regions.append((row[0], [code for code in row[1:] if code]))
+    return regions
+
+def loadRegionSets(tsvFiles):
+    # ordered dict of the set names (file names without extension) -> regions of the files (a dict of set names -> files can be given too)
+    if not isinstance(tsvFiles, dict): tsvFiles = collections.OrderedDict((os.path.splitext(os.path.basename(f))[0], f) for f in tsvFiles)
+    return collections.OrderedDict((setName, loadRegionFile(tsvFile)) for setName, tsvFile in tsvFiles.items())
+
+def createRegionMapping(regionSets, countryIds, size=None):
+    # Compiles the region sets (ordered dict of set names -> list of (region name, codes) tuples) into a region mapping
+    # countryIds is a dict of the country codes -> ids, size is the number of country ids (maxid+1 by default)
+    if size is None: size = max(countryIds.values())+1
+    names, index, sets = list(), dict(), collections.OrderedDict()
+    members = list()
+    unknown = set()
+    for setName, regions in regionSets.items():
+        if SET_SEPARATOR in setName: raise Exception('Invalid set name', setName+' contains '+SET_SEPARATOR)
+        first = len(names)
+        for regionName, codes in regions:
+            name = setName+SET_SEPARATOR+regionName
+            if name in index: raise Exception('Duplicated region', name+' is defined twice.')
+            countries = set()
+            for code in codes:
+                if code in countryIds: countries.add(countryIds[code])
+                # regions of the earlier sets can be included by their qualified name
+                elif code in index: countries.update(members[index[code]])
+                else: unknown.add(code)
+            index[name] = len(names)
+            names.append(name)
+            members.append(countries)
+        sets[setName] = (first, len(names))
+    rows = numpy.concatenate([numpy.zeros([0], dtype='int64')]+[numpy.repeat(i, len(countries)) for i, countries in enumerate(members)])
+    cols = numpy.concatenate([numpy.zeros([0], dtype='int64')]+[numpy.array(sorted(countries), dtype='int64') for countries in members])
+    membership = scipy.sparse.csr_matrix((numpy.ones(rows.size), (rows, cols)), shape=(len(names), size))
+    return RegionMapping(names=names, index=index, sets=sets, membership=membership, unknown=sorted(unknown))
+
+def getSetValues(mapping, values, setName):
+    # region names and values of one set from the results of all regions (e.g. membership.dot(countryTotals))
+    first, last = mapping.sets[setName]
+    return [name.split(SET_SEPARATOR, 1)[1] for name in mapping.names[first:last]], values[first:last]
+
+def getFlatMapping(mapping, setName):
+    # Array of the region index (within the set) of every country id, -1 if the country doesn't belong to any region of the set
+    # (the mapping format of zonal.py and weight_index.py, the regions of the set must not overlap)
+    first, last = mapping.sets[setName]
+    members = mapping.membership[first:last,:].tocoo()
+    if 1<numpy.bincount(members.col, minlength=mapping.membership.shape[1]).max(): raise Exception('Overlapping regions', 'A country belongs to more than one region of '+setName+'.')
+    flat = numpy.empty([mapping.membership.shape[1]], dtype='int')
+    flat[:] = -1
+    flat[members.col] = members.row
+    return flat
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+'''
+Conservative regridding of the SEDAC GPW v3 grids to any rectilinear lat/lon grid
+
+The weights are the overlaps of the source and target cells: the share of every source cell that falls into every
+target cell. On rectilinear grids the overlap matrix is the product of a latitude matrix (area shares, with the sine
+of the cell edges) and a longitude matrix (periodic), so the full [target cells x source cells] matrix never has to
+be stored: the two small sparse factors are cached on disk for every source/target grid pair and a grid is regridded
+with two sparse products, band by band (W x field = latWeights . field . lonWeights^T).
+Counts (e.g. population) are regridded as sums, so the totals are kept, densities and other intensive fields as
+area weighted means of the unmasked cells.
+    weights = regrid.getRegridWeights(sedacLats, sedacLons, targetLatEdges, targetLonEdges)
+    pcountModel = regrid.regridGrid(weights, pcount)
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import collections
+import netCDF4
+import numpy
+import scipy.sparse
+import hashing
+import grid_cache
+import sedac_nc
+
+# latWeights: sparse [target rows x source rows] matrix of the area shares of the source rows in the target rows,
+# lonWeights: sparse [target cols x source cols] matrix of the shares of the source columns in the target columns,
+# sourceRowArea: area of the source cells of every row (km2, only the ratios matter), lats, lons: target cell centers
+RegridWeights = collections.namedtuple('RegridWeights', 'latWeights lonWeights sourceRowArea lats lons')
+
+# number of source rows regridded at once
+BAND_ROWS = 240
+
+def getEdges(centers, bounds=None):
+    # Cell edges (n+1 values in the order of the cells) from the [n x 2] bounds, or from the centers (midpoints)
+    centers = numpy.asarray(centers, dtype='float64')
+    if bounds is not None:
+        bounds = numpy.asarray(bounds, dtype='float64')
+        return numpy.append(bounds[:,0], bounds[-1,1])
+    if 1==centers.size: raise Exception('Invalid grid', 'The edges of a one cell grid must be given.')
+    middle = (centers[1:]+centers[:-1])/2
+    return numpy.concatenate([[2*centers[0]-middle[0]], middle, [2*centers[-1]-middle[-1]]])
+
+def getOverlaps(targetEdges, sourceEdges, measure=None):
+    # Sparse [target x source] matrix of the share of every source interval that falls into every target interval
+    # (the edges have to be increasing), measure transforms the coordinates (e.g. sine of the latitude for areas)
+    if measure is None: measure = lambda x: x
+    first = numpy.searchsorted(sourceEdges, targetEdges[:-1], 'right')-1
+    last = numpy.searchsorted(sourceEdges, targetEdges[1:], 'left')
+    first = numpy.clip(first, 0, sourceEdges.size-1)
+    last = numpy.clip(last, 0, sourceEdges.size-1)
+    counts = numpy.maximum(last-first, 0)
+    rows = numpy.repeat(numpy.arange(counts.size), counts)
+    cols = numpy.repeat(first, counts) + numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts)-counts, counts)
+    low = measure(numpy.maximum(targetEdges[rows], sourceEdges[cols]))
+    high = measure(numpy.minimum(targetEdges[rows+1], sourceEdges[cols+1]))
+    shares = (high-low)/(measure(sourceEdges[cols+1])-measure(sourceEdges[cols]))
+    keep = 0<shares
+    return scipy.sparse.csr_matrix((shares[keep], (rows[keep], cols[keep])), shape=(targetEdges.size-1, sourceEdges.size-1))
+
+def getLatWeights(targetEdges, sourceEdges):
+    # area share matrix of the latitude bands, the edges can be in decreasing order
+    def ascending(edges):
+        return (edges, False) if edges[0]<edges[-1] else (edges[::-1], True)
+    target, flipTarget = ascending(numpy.clip(targetEdges, -90.0, 90.0))
+    source, flipSource = ascending(numpy.clip(sourceEdges, -90.0, 90.0))
+    weights = getOverlaps(target, source, lambda lat: numpy.sin(numpy.radians(lat))).tocoo()
+    rows = weights.shape[0]-1-weights.row if flipTarget else weights.row
+    cols = weights.shape[1]-1-weights.col if flipSource else weights.col
+    return scipy.sparse.csr_matrix((weights.data, (rows, cols)), shape=weights.shape)
+
+def getLonWeights(targetEdges, sourceEdges):
+    # share matrix of the longitude intervals of global source grid (increasing edges), the target can start anywhere
+    period = 360.0
+    ncols = sourceEdges.size-1
+    # the target is shifted after the start of the source, and the source is repeated once to cover the wrapped part
+    targetEdges = targetEdges - numpy.floor((targetEdges[0]-sourceEdges[0])/period)*period
+    source = numpy.concatenate([sourceEdges[:-1], sourceEdges+period])
+    weights = getOverlaps(targetEdges, source).tocoo()
+    return scipy.sparse.csr_matrix((weights.data, (weights.row, weights.col % ncols)), shape=(targetEdges.size-1, ncols))
+
+def buildRegridWeights(sourceLats, sourceLons, targetLatEdges, targetLonEdges):
+    # Creates the regrid weights from a regular global source grid (cell centers) to a rectilinear target grid (cell edges)
+    sourceLatEdges = getEdges(sourceLats)
+    sourceLonEdges = getEdges(sourceLons)
+    if sourceLonEdges[0]>sourceLonEdges[-1]: raise Exception('Invalid grid', 'Source longitudes must be increasing.')
+    targetLatEdges = numpy.asarray(targetLatEdges, dtype='float64')
+    targetLonEdges = numpy.asarray(targetLonEdges, dtype='float64')
+    sines = numpy.sin(numpy.radians(numpy.clip(sourceLatEdges, -90.0, 90.0)))
+    sourceRowArea = numpy.abs(sines[:-1]-sines[1:]) * numpy.radians(abs(sourceLonEdges[1]-sourceLonEdges[0]))
+    return RegridWeights(latWeights=getLatWeights(targetLatEdges, sourceLatEdges), lonWeights=getLonWeights(targetLonEdges, sourceLonEdges),
+                         sourceRowArea=sourceRowArea, lats=(targetLatEdges[:-1]+targetLatEdges[1:])/2, lons=(targetLonEdges[:-1]+targetLonEdges[1:])/2)
+
+def saveRegridWeights(weights, npzFile):
+    arrays = dict(sourceRowArea=weights.sourceRowArea, lats=weights.lats, lons=weights.lons)
+    for name in ('latWeights', 'lonWeights'):
+        matrix = getattr(weights, name)
+        arrays.update({name+'Data': matrix.data, name+'Indices': matrix.indices, name+'Indptr': matrix.indptr, name+'Shape': numpy.array(matrix.shape)})
+    numpy.savez_compressed(npzFile, **arrays)
+
+def loadRegridWeights(npzFile):
+    with numpy.load(npzFile) as f:
+        matrices = dict((name, scipy.sparse.csr_matrix((f[name+'Data'], f[name+'Indices'], f[name+'Indptr']), shape=tuple(f[name+'Shape'])))
+                        for name in ('latWeights', 'lonWeights'))
+        return RegridWeights(sourceRowArea=f['sourceRowArea'], lats=f['lats'], lons=f['lons'], **matrices)
+
+def getRegridWeights(sourceLats, sourceLons, targetLatEdges, targetLonEdges, cacheDir=grid_cache.GRID_CACHE_DIR):
+    # Returns the regrid weights of the grids, they're built only if they aren't in the cache yet
+    # (the weights are stored in the grid cache folder)
+    key = hashing.combinedHash(*[numpy.asarray(a, dtype='float64') for a in (sourceLats, sourceLons, targetLatEdges, targetLonEdges)])
+    npzFile = os.path.join(cacheDir, 'regrid_'+key+'.npz')
+    if grid_cache.isCached(npzFile): return loadRegridWeights(npzFile)
+    weights = buildRegridWeights(sourceLats, sourceLons, targetLatEdges, targetLonEdges)
+    grid_cache.saveAtomic(npzFile, lambda f: saveRegridWeights(weights, f))
+    grid_cache.evict(cacheDir, keep=(npzFile,))
+    return weights
+
+def regridGrid(weights, grid, intensive=False, bandRows=BAND_ROWS):
+    # Regrids a masked (lat, lon) grid (an array, memmap or netCDF variable, read band by band), masked cells count as 0
+    # counts are summed (intensive=False), intensive fields are averaged with the area of the unmasked cells
+    # (target cells without any unmasked source cell are masked)
+    nrows = grid.shape[0]
+    values = numpy.zeros([weights.latWeights.shape[0], grid.shape[1]])
+    area = numpy.zeros([weights.latWeights.shape[0], grid.shape[1]]) if intensive else None
+    for firstRow in range(0, nrows, bandRows):
+        band = numpy.ma.asarray(grid[firstRow:firstRow+bandRows,:])
+        latWeights = weights.latWeights[:,firstRow:firstRow+band.shape[0]]
+        data = numpy.ma.filled(band.astype('float64'), 0.0)
+        if intensive:
+            validArea = (~numpy.ma.getmaskarray(band)) * weights.sourceRowArea[firstRow:firstRow+band.shape[0],numpy.newaxis]
+            values += latWeights.dot(data*validArea)
+            area += latWeights.dot(validArea)
+        else: values += latWeights.dot(data)
+    values = weights.lonWeights.dot(values.T).T
+    if not intensive: return values
+    area = weights.lonWeights.dot(area.T).T
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.ma.masked_where(area<=0, values/area)
+
+def getTargetGrid(ncFile):
+    # (lat edges, lon edges) of the grid of a netCDF file, from the bounds variables (CF bounds attribute) if they exist
+    nc = netCDF4.Dataset(ncFile, 'r')
+    try:
+        edges = list()
+        for name in ('lat', 'lon'):
+            var = nc.variables[name]
+            bounds = nc.variables[var.getncattr('bounds')][:] if 'bounds' in var.ncattrs() else None
+            edges.append(getEdges(var[:], bounds))
+        return tuple(edges)
+    finally:
+        nc.close()
+
+def regridNcFile(ncFile, var, targetNcFile, outFile, intensive=False, cacheDir=grid_cache.GRID_CACHE_DIR):
+    # Regrids a (lat, lon) variable of a SEDAC netCDF file to the grid of another netCDF file and writes the result
+    nc = netCDF4.Dataset(ncFile, 'r')
+    try:
+        ncVar = nc.variables[var]
+        latEdges, lonEdges = getTargetGrid(targetNcFile)
+        weights = getRegridWeights(nc.variables['lat'][:], nc.variables['lon'][:], latEdges, lonEdges, cacheDir)
+        values = regridGrid(weights, ncVar, intensive)
+        attributes = dict((name, ncVar.getncattr(name)) for name in ('long_name', 'units', 'standard_name') if name in ncVar.ncattrs())
+    finally:
+        nc.close()
+    out = netCDF4.Dataset(outFile, 'w', format='NETCDF4')
+    try:
+        out.createDimension('lat', weights.lats.size)
+        out.createDimension('lon', weights.lons.size)
+        out.createDimension('nv', 2)
+        for name, centers, edges, standardName, units in (('lat', weights.lats, latEdges, 'latitude', 'degrees_north'),
+                                                          ('lon', weights.lons, lonEdges, 'longitude', 'degrees_east')):
+            rvVar = out.createVariable(name, 'f8', (name,))
+            rvVar.setncattr('standard_name', standardName)
+            rvVar.setncattr('long_name', standardName)
+            rvVar.setncattr('bounds', name+'_bnds')
+            rvVar.units = units
+            rvVar[:] = centers
+            out.createVariable(name+'_bnds', 'f8', (name, 'nv'))[:] = numpy.column_stack([edges[:-1], edges[1:]])
+        rvVar = out.createVariable(var, 'f4', ('lat', 'lon'), fill_value=1e+20, zlib=True, complevel=sedac_nc.COMPRESSION_LEVEL, shuffle=True)
+        for name, value in attributes.items(): rvVar.setncattr(name, value)
+        rvVar[:] = values
+    finally:
+        out.close()
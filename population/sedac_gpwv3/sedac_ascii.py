@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+'''
+Streaming reader of the SEDAC GPW v3 gzipped ascii grid files
+
+The gzip stream is decoded in blocks of rows and the values are parsed by numpy straight into
+typed arrays, so there is no Python level tokenizing of the ~30M values of a 2.5' grid.
+The grid can be loaded at once into a preallocated array (loadAsciiFile), or it can be
+processed band by band (iterAsciiBands) with memory bounded by the band size.
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import collections
+import gzip
+import itertools
+import numpy
+
+AsciiHeader = collections.namedtuple('AsciiHeader', 'ncols nrows xllcorner yllcorner cellsize NODATA_value')
+
+# default number of rows decoded at once (~2M values of a 2.5' grid)
+BAND_ROWS = 240
+
+def getBandRows(factors, bandRows=BAND_ROWS):
+    # Band size close to bandRows that is a multiple of all the factors (so bands can be block reduced one by one)
+    multiple = 1
+    for factor in factors:
+        a, b = multiple, factor
+        while b: a, b = b, a % b
+        multiple = multiple*factor//a
+    return multiple*max(1, int(round(float(bandRows)/multiple)))
+
+def parseAsciiHeader(fascii):
+    # Reads and checks the 6 header rows of an opened ascii file, the file is left positioned at the first data row
+    def nextRow():
+        return fascii.readline().decode('ascii').split()
+    row = nextRow()
+    if not row or 'ncols'!=row[0]: raise Exception('IO error', 'Invalid 1st line: does not start with "ncols".')
+    else: ncols = int(row[-1])
+    row = nextRow()
+    if not row or 'nrows'!=row[0]: raise Exception('IO error', 'Invalid 2nd line: does not start with "nrows".')
+    else: nrows = int(row[-1])
+    row = nextRow()
+    if not row or 'xllcorner'!=row[0]: raise Exception('IO error', 'Invalid 3rd line: does not start with "xllcorner".')
+    else: xllcorner = float(row[-1])
+    if -180!=xllcorner: raise Exception('IO error', 'Invalid 3rd line: "xllcorner" must be -180 (correct the script otherwise).')
+    row = nextRow()
+    if not row or 'yllcorner'!=row[0]: raise Exception('IO error', 'Invalid 4th line: does not start with "yllcorner".')
+    else: yllcorner = float(row[-1])
+    if 0<yllcorner: raise Exception('IO error', 'Invalid 4th line: "yllcorner" must be negative (correct the script otherwise).')
+    row = nextRow()
+    if not row or 'cellsize'!=row[0]: raise Exception('IO error', 'Invalid 5th line: does not start with "cellsize".')
+    else: cellsize = float(row[-1])
+    row = nextRow()
+    if not row or 'NODATA_value'!=row[0]: raise Exception('IO error', 'Invalid 6th line: does not start with "NODATA_value".')
+    else: NODATA_value = float(row[-1])
+    return AsciiHeader(ncols=ncols, nrows=nrows, xllcorner=xllcorner, yllcorner=yllcorner, cellsize=cellsize, NODATA_value=NODATA_value)
+
+def readAsciiHeader(asciiGzFile):
+    # Returns the checked header of a gzipped ascii file without reading the data
+    with gzip.open(asciiGzFile, 'rb') as fascii:
+        return parseAsciiHeader(fascii)
+
+def iterAsciiBands(asciiGzFile, dtype, bandRows=BAND_ROWS):
+    # Yields (firstRow, band) tuples, where band is a [bandRows x ncols] array of the given dtype (the last band can be shorter)
+    # NODATA values are kept as they are, a band is never reused after it has been yielded
+    with gzip.open(asciiGzFile, 'rb') as fascii:
+        header = parseAsciiHeader(fascii)
+        firstRow = 0
+        while firstRow<header.nrows:
+            rows = min(bandRows, header.nrows-firstRow)
+            band = numpy.empty([rows, header.ncols], dtype=dtype)
+            readAsciiRows(fascii, band, firstRow)
+            yield firstRow, band
+            firstRow += rows
+        checkAsciiEnd(fascii)
+
+def countSpacedValues(line):
+    # number of values of a line whose values are separated by single spaces (more spaces make it bigger)
+    end = len(line) - (2 if line.endswith(b'\r\n') else 1 if line.endswith(b'\n') else 0)
+    if 0==end: return 0
+    return line.count(b' ', 0, end) + 1 - (b' '==line[0:1]) - (b' '==line[end-1:end])
+
+def countRowValues(lines, total):
+    # Number of values in every line of ascii rows without tokenizing them: the spaces are counted, which is exact if
+    # the counts add up to the total number of parsed values, the lines are split only if they don't (e.g. more spaces)
+    counts = numpy.array([countSpacedValues(line) for line in lines], dtype='int64')
+    if total!=counts.sum() or any(b'\t' in line for line in lines):
+        counts = numpy.array([len(line.split()) for line in lines], dtype='int64')
+    return counts
+
+def readAsciiRows(fascii, out, firstRow=0):
+    # Decodes the next out.shape[0] rows of an opened ascii file into the preallocated out array,
+    # every row must have ncols values (wrapped or misaligned rows aren't accepted)
+    rows, ncols = out.shape
+    lines = list(itertools.islice(fascii, rows))
+    if len(lines)<rows: raise Exception('IO error', 'Invalid data: the file ends at row {0} instead of row {1}.'.format(firstRow+len(lines), firstRow+rows))
+    data = b''.join(lines)
+    values = numpy.fromstring(data, dtype=out.dtype, sep=' ')
+    counts = countRowValues(lines, values.size)
+    invalid = numpy.flatnonzero(counts!=ncols)
+    if invalid.size: raise Exception('IO error', 'Invalid data in row {0}: {1} values instead of {2}.'.format(firstRow+invalid[0], counts[invalid[0]], ncols))
+    if values.size!=rows*ncols:
+        raise Exception('IO error', 'Invalid data between row {0} and {1}: {2} values instead of {3}.'.format(firstRow, firstRow+rows, values.size, rows*ncols))
+    out[:,:] = values.reshape([rows, ncols])
+    return out
+
+def checkAsciiEnd(fascii):
+    # there can't be any data after the last row
+    if fascii.readline().strip(): raise Exception('IO error', 'Invalid data: more rows than "nrows".')
+
+def loadAsciiFile(asciiGzFile, dtype, bandRows=BAND_ROWS):
+    # Loads the whole grid into a preallocated array, NODATA cells are masked
+    with gzip.open(asciiGzFile, 'rb') as fascii:
+        header = parseAsciiHeader(fascii)
+        var_asc = numpy.empty([header.nrows, header.ncols], dtype=dtype)
+        for firstRow in range(0, header.nrows, bandRows):
+            readAsciiRows(fascii, var_asc[firstRow:firstRow+bandRows,:], firstRow)
+        checkAsciiEnd(fascii)
+    return header, numpy.ma.masked_equal(var_asc, header.NODATA_value, copy=False)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+'''
+netCDF files of the SEDAC GPW v3 grids
+
+The grid variables are written with compact dtypes (int16 ids, float32 counts), zlib compression and chunks that are
+small enough for fast regional window reads but big enough for fast full grid reads. The files are created empty and
+the data is streamed into them band by band, so the whole grid never has to be staged in memory.
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import numpy
+import netCDF4
+
+# chunk shape of the grid variables (a 10°x20° window of the 2.5' grid, or the quarter of the 1/2° grid)
+CHUNK_SHAPE = (240, 480)
+COMPRESSION_LEVEL = 4
+# northern edge of the SEDAC GPW v3 ascii grids
+TOP_LAT = 85.0
+
+def getGridCoordinates(gridSize):
+    # Cell center coordinates of a global grid, latitudes are in decreasing order
+    lons = -180.0 + gridSize/2 + numpy.arange(int(round(360/gridSize)))*gridSize
+    lats = 90.0 - gridSize/2 - numpy.arange(int(round(180/gridSize)))*gridSize
+    return lats, lons
+
+def loadGridCoordinates(ncFile):
+    # lat, lon coordinates of the grid of a netCDF file
+    nc = netCDF4.Dataset(ncFile, 'r')
+    try:
+        return nc.variables['lat'][:], nc.variables['lon'][:]
+    finally:
+        nc.close()
+
+def getStartLat(header, gridSize):
+    # Index of the global grid row where the first row of the ascii file is stored
+    return getTopRow(header.yllcorner+header.nrows*(360.0/header.ncols), gridSize)
+
+def getTopRow(top, gridSize):
+    # Index of the global grid row where the first row of a grid with the given northern edge is stored
+    return int(round((90.0-top)/gridSize-1))
+
+def checkSameGrid(lats, lons, otherLats, otherLons):
+    # check if we use the same grid resolution and ordering
+    if not(numpy.array_equal(lats, otherLats)): raise Exception('Different lat coordinates!')
+    if not(numpy.array_equal(lons, otherLons)): raise Exception('Different lon coordinates!')
+
+def getReshapingFactor(header, gridSize):
+    # Number of cells of a SEDAC ascii grid in the side of a lower resolution cell of the given grid size
+    dv = int(round(gridSize*header.ncols/360.0))
+    if dv<1 or 1e-9<abs(dv*360.0/header.ncols-gridSize): raise Exception('Invalid grid size', '{0:g}° is not a multiple of the original grid size.'.format(gridSize))
+    return dv
+
+def createGridDataset(ncFile, gridSize):
+    # Creates a netCDF file with the lat, lon coordinates of a global grid and returns the opened dataset
+    lats, lons = getGridCoordinates(gridSize)
+    nc = netCDF4.Dataset(ncFile, 'w', format='NETCDF4')
+
+    nc.createDimension('lat', lats.size)
+    nc.createDimension('lon', lons.size)
+
+    rvLat = nc.createVariable('lat','f8',('lat',))
+    rvLat.setncattr('standard_name', 'latitude')
+    rvLat.setncattr('long_name', 'latitude')
+    rvLat.setncattr('axis', 'Y')
+    rvLat.units = 'degrees_north'
+    rvLat[:] = lats
+
+    rvLon = nc.createVariable('lon','f8',('lon',))
+    rvLon.setncattr('standard_name', 'longitude')
+    rvLon.setncattr('long_name', 'longitude')
+    rvLon.setncattr('axis', 'X')
+    rvLon.units = 'degrees_east'
+    rvLon[:] = lons
+    return nc
+
+def createSEDACncFile(ncFile, gridSize, varName, dtype, fill_value, attributes, chunkShape=CHUNK_SHAPE, years=None):
+    # Creates a netCDF file with lat, lon coordinates and an empty, compressed and chunked (lat, lon) grid variable
+    # (or a (year, lat, lon) stack of grids if the years are given, one chunk is in one year)
+    # returns the opened dataset and the grid variable, so the data can be written into it band by band
+    nc = createGridDataset(ncFile, gridSize)
+    nlat, nlon = len(nc.dimensions['lat']), len(nc.dimensions['lon'])
+    dimensions, chunkSizes = ('lat','lon',), (min(chunkShape[0], nlat), min(chunkShape[1], nlon))
+    if years is not None:
+        nc.createDimension('year', len(years))
+        rvYear = nc.createVariable('year', 'i4', ('year',))
+        rvYear.setncattr('long_name', 'year of the epoch')
+        rvYear[:] = years
+        dimensions, chunkSizes = ('year',)+dimensions, (1,)+chunkSizes
+    rvVar = nc.createVariable(varName, dtype, dimensions, fill_value=fill_value, zlib=True, complevel=COMPRESSION_LEVEL,
+                              shuffle=True, chunksizes=chunkSizes)
+    for name in ['long_name', 'units', 'standard_name']:
+        if name in attributes: rvVar.setncattr(name, attributes[name])
+    return nc, rvVar
+
+def fillRows(rvVar, startRow, stopRow, value, bandRows=CHUNK_SHAPE[0], index=()):
+    # Writes a constant value into the given rows of a grid variable (e.g. 0 population outside the SEDAC data)
+    # index selects the grid of a stack (e.g. (i,) for the i-th year)
+    for firstRow in range(startRow, stopRow, bandRows):
+        rows = min(bandRows, stopRow-firstRow)
+        band = numpy.empty([rows, rvVar.shape[-1]], dtype=rvVar.dtype)
+        band[:,:] = value
+        rvVar[index+(slice(firstRow, firstRow+rows), slice(None))] = band
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+'''
+Checking the SEDAC GPW v3 national identifier grid translation against the reference results
+
+Converts gl_gpwv3_ntlbndid_ascii_25/glbnds.asc.gz and compares the 2.5' and 1/2° grids with the reference
+results/glbnds_25.nc.gz and results/glbnds_half.nc.gz (the ids, the masks and the coordinates have to be the same).
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import netCDF4
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import convert_ntlnbd
+import instrumentation
+
+def log(message):
+    sys.stdout.write(message)
+
+def decompress(gzFile, ncFile):
+    with gzip.open(gzFile, 'rb') as fin:
+        with open(ncFile, 'wb') as fout:
+            shutil.copyfileobj(fin, fout)
+
+def compareGrids(ncFile, referenceNcFile):
+    # list of the differences of the glbnds variables and coordinates of two files (empty if they are the same)
+    differences = list()
+    nc, ref = netCDF4.Dataset(ncFile, 'r'), netCDF4.Dataset(referenceNcFile, 'r')
+    try:
+        for name in ('lat', 'lon'):
+            if not numpy.array_equal(nc.variables[name][:], ref.variables[name][:]): differences.append('different '+name+' coordinates')
+        grid, refGrid = numpy.ma.asarray(nc.variables['glbnds'][:]), numpy.ma.asarray(ref.variables['glbnds'][:])
+        if grid.shape!=refGrid.shape: return differences+['shape {0} instead of {1}'.format(grid.shape, refGrid.shape)]
+        mask, refMask = numpy.ma.getmaskarray(grid), numpy.ma.getmaskarray(refGrid)
+        if (mask!=refMask).any(): differences.append('{0} cells are masked differently'.format((mask!=refMask).sum()))
+        different = ~mask & ~refMask & (numpy.ma.getdata(grid)!=numpy.ma.getdata(refGrid))
+        if different.any(): differences.append('{0} cells have different ids'.format(different.sum()))
+    finally:
+        nc.close()
+        ref.close()
+    return differences
+
+if __name__ == "__main__":
+    # converting without the grid cache, so the ascii parsing is checked too
+    tmpDir = tempfile.mkdtemp()
+    try:
+        with instrumentation.stage('convert'):
+            convert_ntlnbd.convertSEDACglbndsAscii2nc('../gl_gpwv3_ntlbndid_ascii_25/glbnds.asc.gz', os.path.join(tmpDir, 'glbnds'), [('_half', 0.5)],
+                                                      gridCacheDir=None, shares=False)
+        failed = False
+        for suffix in ('_25', '_half'):
+            with instrumentation.stage('compare '+suffix):
+                referenceNcFile = os.path.join(tmpDir, 'reference'+suffix+'.nc')
+                decompress('../results/glbnds'+suffix+'.nc.gz', referenceNcFile)
+                differences = compareGrids(os.path.join(tmpDir, 'glbnds'+suffix+'.nc'), referenceNcFile)
+            if differences: failed = True
+            log('glbnds'+suffix+': '+(', '.join(differences) if differences else 'identical to the reference')+'\n')
+    finally:
+        shutil.rmtree(tmpDir)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+'''
+Checking the tiled zonal sums with a grid cache that is smaller than the grids
+
+The grid cache is limited to 20MB (SEDAC_GRID_CACHE_SIZE), so the 2.5' glbnds and pcount entries don't fit into it
+together: copying the pcount grid into the cache must not evict the glbnds entry, which the workers open by name.
+The pcount grid is 1 in every land cell, so the zonal sums are the number of cells of the countries.
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import sys
+import shutil
+import tempfile
+import netCDF4
+import numpy
+
+# the cache settings are read when grid_cache is imported
+tmpDir = tempfile.mkdtemp()
+os.environ['SEDAC_GRID_CACHE'] = os.path.join(tmpDir, 'cache')
+os.environ['SEDAC_GRID_CACHE_SIZE'] = '20'
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import convert_ntlnbd
+import instrumentation
+import sedac_nc
+import tiling
+import zonal
+
+def log(message):
+    sys.stdout.write(message)
+
+def createOnesNcFile(glbndsNcFile, pcountNcFile):
+    # pcount grid of the glbnds grid with 1 in every land cell, returns the glbnds ids
+    nc = netCDF4.Dataset(glbndsNcFile, 'r')
+    try:
+        glbnds = nc.variables['glbnds'][:]
+    finally:
+        nc.close()
+    nc, rvVar = sedac_nc.createSEDACncFile(pcountNcFile, 360.0/glbnds.shape[1], 'pcount', 'f4', -9999.0, {'units': 'persons'})
+    try:
+        rvVar[:,:] = numpy.ma.masked_where(numpy.ma.getmaskarray(glbnds), numpy.ones(glbnds.shape, dtype='float32'))
+    finally:
+        nc.close()
+    return glbnds
+
+if __name__ == "__main__":
+    failed = True
+    try:
+        with instrumentation.stage('convert'):
+            convert_ntlnbd.convertSEDACglbndsAscii2nc('../gl_gpwv3_ntlbndid_ascii_25/glbnds.asc.gz', os.path.join(tmpDir, 'glbnds'), [],
+                                                      gridCacheDir=None, shares=False)
+        glbndsNcFile, pcountNcFile = os.path.join(tmpDir, 'glbnds_25.nc'), os.path.join(tmpDir, 'pcount_25.nc')
+        glbnds = createOnesNcFile(glbndsNcFile, pcountNcFile)
+        size = int(glbnds.max())+1
+        expected = zonal.zonalSums(glbnds, numpy.ma.masked_where(numpy.ma.getmaskarray(glbnds), numpy.ones(glbnds.shape)), size)
+        with instrumentation.stage('tiledZonalSums'):
+            totals = tiling.tiledZonalSums(glbndsNcFile, pcountNcFile, size, processes=2, memoryBudget=8<<20)
+        failed = not numpy.array_equal(totals, expected)
+        log('tiled zonal sums with a 20MB grid cache: '+('different from the zonal sums' if failed else 'identical to the zonal sums')+'\n')
+    finally:
+        shutil.rmtree(tmpDir)
+    sys.exit(1 if failed else 0)
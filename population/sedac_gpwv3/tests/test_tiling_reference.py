@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+'''
+Checking the tiled downsampling of the SEDAC GPW v3 grids against the coarse grids of the converters
+
+Converts gl_gpwv3_ntlbndid_ascii_25/glbnds.asc.gz into 2.5', 1/2° and 1° grids, downsamples the 2.5' grid with
+tiling.downsampleNcGrid in small tiles, and compares the results with the 1/2° and 1° grids of the converter
+(the ids, the masks and the coordinates have to be the same).
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import convert_ntlnbd
+import instrumentation
+import tiling
+from test_glbnds_reference import compareGrids
+
+def log(message):
+    sys.stdout.write(message)
+
+if __name__ == "__main__":
+    tmpDir = tempfile.mkdtemp()
+    try:
+        with instrumentation.stage('convert'):
+            convert_ntlnbd.convertSEDACglbndsAscii2nc('../gl_gpwv3_ntlbndid_ascii_25/glbnds.asc.gz', os.path.join(tmpDir, 'glbnds'),
+                                                      [('_half', 0.5), ('_1deg', 1.0)], gridCacheDir=None, shares=False)
+        failed = False
+        for suffix, factor in (('_half', 12), ('_1deg', 24)):
+            tiledNcFile = os.path.join(tmpDir, 'tiled'+suffix+'.nc')
+            # a small memory budget, so the grid is split into many tiles
+            with instrumentation.stage('downsample '+suffix):
+                tiling.downsampleNcGrid(os.path.join(tmpDir, 'glbnds_25.nc'), 'glbnds', tiledNcFile, factor, tiling.REDUCTIONS['majority'],
+                                        processes=2, memoryBudget=8<<20, cacheDir=os.path.join(tmpDir, 'cache'))
+            differences = compareGrids(tiledNcFile, os.path.join(tmpDir, 'glbnds'+suffix+'.nc'))
+            if differences: failed = True
+            log('glbnds'+suffix+': '+(', '.join(differences) if differences else 'tiled grid identical to the converter')+'\n')
+    finally:
+        shutil.rmtree(tmpDir)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+'''
+Checking the rescaling of the population epochs to the UN totals on a small synthetic stack
+
+With a single UN file the growth of the countries between the epochs has to be kept (every year is rescaled with the
+ratio of the UN year), with two UN files the rescaled totals have to be the UN totals in both years, and without UN
+files the factors have to be 1.
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import sys
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import population_epochs
+import grid_store
+
+EPOCHS = [1990, 1995, 2000]
+YEARS = range(1985, 2011)
+# UN code of the country ids 0, 1, 2 (the countries 1 and 2 have the same UN code, 3 has no UN code)
+UN_CODES = numpy.array([4, 8, 8, -1])
+UN_POPULATION = {1990: {4: 900.0, 8: 2400.0}, 2000: {4: 1200.0, 8: 2600.0}}
+
+def log(message):
+    sys.stdout.write(message)
+
+def createStack():
+    # 3 epochs of a 4x6 grid of 4 countries growing at different rates, the last row is sea
+    fill = -9999.0
+    glbnds = numpy.ma.masked_equal(numpy.array([[0, 0, 1, 1, 2, 3]]*3+[[-1]*6]), -1)
+    growth = numpy.array([1.0, 1.1, 0.9, 1.3])
+    data = numpy.empty([len(EPOCHS), 4, 6])
+    for i in range(len(EPOCHS)):
+        data[i] = numpy.where(numpy.ma.getmaskarray(glbnds), fill, 10.0*growth[numpy.ma.getdata(glbnds)]**i)
+    lats, lons = numpy.arange(4)+0.5, numpy.arange(6)+0.5
+    return population_epochs.PopulationStack(years=numpy.array(EPOCHS, dtype='float64'), data=data, fill=fill, lats=lats, lons=lons), glbnds
+
+def getUNPops(unYears):
+    return dict((unYear, dict((code, grid_store.UNData(name=str(code), unsdcode=code, population=population))
+                              for code, population in UN_POPULATION[unYear].items())) for unYear in unYears)
+
+def getRescaledTotals(stack, glbnds, unYears):
+    totals = population_epochs.aggregatePopulation(stack, glbnds, YEARS, UN_CODES.size)
+    unYearTotals = population_epochs.aggregatePopulation(stack, glbnds, unYears, UN_CODES.size) if unYears else None
+    factors = population_epochs.getUNFactors(unYearTotals, UN_CODES, getUNPops(unYears), YEARS)
+    return totals, totals*factors, factors
+
+def getUNTotals(totals, unYear):
+    # totals of the UN codes in a year
+    row = totals[list(YEARS).index(unYear)]
+    return dict((code, row[UN_CODES==code].sum()) for code in UN_POPULATION[unYear])
+
+if __name__ == "__main__":
+    stack, glbnds = createStack()
+    failures = list()
+    # one UN year: the totals of the UN year are the UN totals, and the growth between the years is kept
+    totals, rescaled, factors = getRescaledTotals(stack, glbnds, [2000])
+    unTotals = getUNTotals(rescaled, 2000)
+    if not all(numpy.isclose(unTotals[code], population) for code, population in UN_POPULATION[2000].items()): failures.append('single UN year: not the UN totals in 2000')
+    if not numpy.allclose(rescaled/rescaled[[list(YEARS).index(2000)]], totals/totals[[list(YEARS).index(2000)]]): failures.append('single UN year: the growth between the epochs is changed')
+    # two UN years: the totals of both UN years are the UN totals
+    totals, rescaled, factors = getRescaledTotals(stack, glbnds, [1990, 2000])
+    for unYear in (1990, 2000):
+        unTotals = getUNTotals(rescaled, unYear)
+        if not all(numpy.isclose(unTotals[code], population) for code, population in UN_POPULATION[unYear].items()): failures.append('two UN years: not the UN totals in {0}'.format(unYear))
+    if not (factors[:,3]==1).all(): failures.append('two UN years: a country without UN code is rescaled')
+    # no UN years: nothing is rescaled
+    totals, rescaled, factors = getRescaledTotals(stack, glbnds, [])
+    if factors.shape!=totals.shape or not (factors==1).all(): failures.append('no UN years: the factors are not 1')
+    for failure in failures: log(failure+'\n')
+    log('UN factors: '+('{0} checks failed'.format(len(failures)) if failures else 'all checks passed')+'\n')
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+'''
+Out-of-core tiled execution of the SEDAC GPW v3 downsampling and aggregation for high resolution (e.g. 30") grids
+
+The grids are processed in row tiles in a process (or thread) pool. Every worker opens the memory-mapped grid cache
+entries itself and copies only its tile into memory, the partial results of the tiles (e.g. bincounts of the zonal
+sums) are combined in a reduce step as they arrive, and the downsampled tiles are written directly into a memory-mapped
+result. The number of rows of the tiles is chosen so that the tiles processed at the same time fit into the memory budget
+(SEDAC_MEMORY_BUDGET environment variable in MB, or the memoryBudget arguments).
+
+Usage:
+    python tiling.py --nc results/pcount30s_25.nc --var pcount --factor 60 --reduction sum --output results/pcount30s_half.nc
+                     --processes 8 --memory 2048
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import argparse
+import functools
+import collections
+import multiprocessing
+import multiprocessing.pool
+import netCDF4
+import numpy
+import grid_cache
+import sedac_nc
+import downsampling
+import zonal
+import instrumentation
+import convert_ntlnbd
+
+MEMORY_BUDGET = grid_cache.MEMORY_BUDGET
+# estimated peak memory of the processing of one cell of a tile in bytes (the tile copies and the temporary arrays)
+ZONAL_BYTES_PER_CELL = 40
+BLOCK_BYTES_PER_CELL = 48
+
+# rows of a tile: firstRow <= row < lastRow
+Tile = collections.namedtuple('Tile', 'firstRow lastRow')
+# .npy file of a grid (e.g. a grid cache entry) and its NODATA/fill value (masked cells)
+GridFile = collections.namedtuple('GridFile', 'npyFile fill')
+
+def getWorkers(processes=None):
+    return processes or multiprocessing.cpu_count()
+
+def getTileRows(ncols, bytesPerCell, workers=1, memoryBudget=MEMORY_BUDGET, multiple=1):
+    # number of rows of the tiles (a multiple of the given number), so that the tiles processed at the same time fit
+    # into the memory budget - at least one multiple, even if that doesn't fit
+    rows = memoryBudget // (workers*ncols*bytesPerCell)
+    return int(max(multiple, rows//multiple*multiple))
+
+def getTiles(nrows, tileRows, startRow=0):
+    return [Tile(firstRow=firstRow, lastRow=min(firstRow+tileRows, nrows)) for firstRow in range(startRow, nrows, tileRows)]
+
+def runTiles(function, tiles, reduce=None, initial=None, processes=None, threads=False):
+    # Runs function(tile) on every tile in a pool of processes (or threads, the function has to be picklable for processes)
+    # and combines the partial results with reduce(accumulated, partial) as they arrive, returns the accumulated result
+    workers = min(getWorkers(processes), len(tiles))
+    if workers<=1:
+        pool = None
+        results = (function(tile) for tile in tiles)
+    else:
+        pool = multiprocessing.pool.ThreadPool(workers) if threads else multiprocessing.Pool(workers)
+        results = pool.imap_unordered(function, tiles)
+    try:
+        accumulated = initial
+        for partial in results:
+            if reduce is not None: accumulated = reduce(accumulated, partial)
+        return accumulated
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def openTile(gridFile, tile):
+    # copy of the rows of a tile of a grid file, masked where it has the fill value
+    data = numpy.load(gridFile.npyFile, mmap_mode='r')
+    return numpy.ma.masked_equal(numpy.array(data[tile.firstRow:tile.lastRow,:]), numpy.asarray(gridFile.fill, dtype=data.dtype)[()], copy=False)
+
+def getGridShape(gridFile):
+    return numpy.load(gridFile.npyFile, mmap_mode='r').shape
+
+def getNcGridFile(ncFile, var, cacheDir=grid_cache.GRID_CACHE_DIR, keep=()):
+    # grid file of a (lat, lon) netCDF variable (copied into the grid cache if needed), and its lat, lon coordinates
+    # keep is the grid files used in the same run, the workers open them by name, so they mustn't be evicted
+    npyFile, meta = grid_cache.getNcGridEntry(ncFile, var, cacheDir, keep=[gridFile.npyFile for gridFile in keep])
+    return GridFile(npyFile=npyFile, fill=meta['NODATA_value']), numpy.array(meta['lat']), numpy.array(meta['lon'])
+
+def zonalSumsTile(glbndsFile, pcountFile, size, mapping, tile):
+    return zonal.zonalSums(openTile(glbndsFile, tile), openTile(pcountFile, tile), size, mapping)
+
+def tiledZonalSums(glbndsNcFile, pcountNcFile, size, mapping=None, processes=None, threads=False, memoryBudget=MEMORY_BUDGET, cacheDir=grid_cache.GRID_CACHE_DIR):
+    # Same as zonal.zonalSums of the glbnds and pcount variables of two netCDF files, the bincounts of the tiles are summed
+    glbnds, latsG, lonsG = getNcGridFile(glbndsNcFile, 'glbnds', cacheDir)
+    pcount, latsP, lonsP = getNcGridFile(pcountNcFile, 'pcount', cacheDir, keep=[glbnds])
+    sedac_nc.checkSameGrid(latsG, lonsG, latsP, lonsP)
+    nrows, ncols = getGridShape(glbnds)
+    tiles = getTiles(nrows, getTileRows(ncols, ZONAL_BYTES_PER_CELL, getWorkers(processes), memoryBudget))
+    with instrumentation.stage('tiledZonalSums', cells=nrows*ncols):
+        return runTiles(functools.partial(zonalSumsTile, glbnds, pcount, size, mapping), tiles, numpy.add, numpy.zeros(size), processes, threads)
+
+def blockReduceTile(gridFile, factor, reduction, outFile, offset, tile):
+    # reduces the tile (its first row is offset by a multiple of the factor) and writes it into the memory-mapped result
+    res = reduction(openTile(gridFile, tile), factor)
+    out = numpy.load(outFile.npyFile, mmap_mode='r+')
+    outRow = (tile.firstRow-offset)//factor
+    out[outRow:outRow+res.shape[0],:] = numpy.ma.filled(res, outFile.fill).astype(out.dtype)
+    out.flush()
+    return res.size
+
+def tiledBlockReduce(gridFile, factor, reduction, outNpyFile, dtype, fill, processes=None, threads=False, memoryBudget=MEMORY_BUDGET, offset=0):
+    # Reduces every factor*factor square of a grid file with a downsampling function (e.g. downsampling.blockSum, or
+    # functools.partial(downsampling.blockMajority, overrides=...)) into a new .npy grid file, returns its grid file
+    # the squares start at the offset row (the rows above it aren't part of any square)
+    nrows, ncols = getGridShape(gridFile)
+    out = numpy.lib.format.open_memmap(outNpyFile, mode='w+', dtype=dtype, shape=downsampling.getBlockShape((nrows-offset, ncols), factor))
+    out[:,:] = fill
+    out.flush()
+    del out
+    outFile = GridFile(npyFile=outNpyFile, fill=fill)
+    tiles = getTiles(nrows, getTileRows(ncols, BLOCK_BYTES_PER_CELL, getWorkers(processes), memoryBudget, multiple=factor), offset)
+    with instrumentation.stage('tiledBlockReduce', cells=nrows*ncols):
+        runTiles(functools.partial(blockReduceTile, gridFile, factor, reduction, outFile, offset), tiles, None, None, processes, threads)
+    return outFile
+
+def downsampleNcGrid(ncFile, var, outNcFile, factor, reduction, processes=None, threads=False, memoryBudget=MEMORY_BUDGET, cacheDir=grid_cache.GRID_CACHE_DIR,
+                     top=sedac_nc.TOP_LAT):
+    # Creates a lower resolution netCDF file of a global SEDAC grid (e.g. a 30" grid converted by the converters),
+    # the number of rows and columns of the grid must be multiples of the factor, the squares are aligned to the first
+    # row of the data (the northern edge of the ascii files) like in the converters, so the results are the same
+    gridFile, lats, lons = getNcGridFile(ncFile, var, cacheDir)
+    if 0!=lats.size % factor or 0!=lons.size % factor: raise Exception('Invalid factor', 'The grid size is not a multiple of the reshaping factor.')
+    offset = sedac_nc.getTopRow(top, 360.0/lons.size) % factor
+    nc = netCDF4.Dataset(ncFile, 'r')
+    try:
+        ncVar = nc.variables[var]
+        dtype = ncVar.dtype
+        attributes = dict((name, ncVar.getncattr(name)) for name in ('long_name', 'units', 'standard_name') if name in ncVar.ncattrs())
+    finally:
+        nc.close()
+    outNpyFile = outNcFile+'.{0}.tmp.npy'.format(os.getpid())
+    try:
+        outFile = tiledBlockReduce(gridFile, factor, reduction, outNpyFile, dtype, gridFile.fill, processes, threads, memoryBudget, offset)
+        out = numpy.load(outFile.npyFile, mmap_mode='r')
+        with instrumentation.stage('writeNcFile', cells=out.size) as s:
+            gridSize = 360.0*factor/lons.size
+            nc, rvVar = sedac_nc.createSEDACncFile(outNcFile, gridSize, var, dtype.str[1:], numpy.asarray(gridFile.fill, dtype=dtype)[()], attributes)
+            try:
+                for firstRow in range(0, out.shape[0], sedac_nc.CHUNK_SHAPE[0]):
+                    band = out[firstRow:firstRow+sedac_nc.CHUNK_SHAPE[0],:]
+                    rvVar[firstRow:firstRow+band.shape[0],:] = numpy.ma.masked_equal(band, numpy.asarray(outFile.fill, dtype=out.dtype)[()])
+            finally:
+                nc.close()
+            s.count(bytesWritten=instrumentation.fileSize(outNcFile))
+        del out
+    finally:
+        if os.path.exists(outNpyFile): os.remove(outNpyFile)
+
+REDUCTIONS = {'sum': downsampling.blockSum, 'mean': downsampling.blockMean,
+              'majority': functools.partial(downsampling.blockMajority, overrides=convert_ntlnbd.SEA_THRESHOLD_OVERRIDES)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Downsamples high resolution SEDAC GPW v3 netCDF grids in parallel tiles.')
+    parser.add_argument('--nc', required=True, help='global (lat, lon) netCDF grid (e.g. a converted 30" grid)')
+    parser.add_argument('--var', required=True, help='name of the grid variable (glbnds, pcount, pdens)')
+    parser.add_argument('--factor', type=int, required=True, help='reshaping factor (e.g. 60 for 30" -> 0.5°)')
+    parser.add_argument('--reduction', choices=sorted(REDUCTIONS.keys()), required=True, help='sum for counts, mean for densities, majority for ids')
+    parser.add_argument('--output', required=True, help='lower resolution netCDF file')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (default: number of cores)')
+    parser.add_argument('--memory', type=int, default=MEMORY_BUDGET>>20, help='memory budget of the tiles in MB')
+    args = parser.parse_args()
+    downsampleNcGrid(args.nc, args.var, args.output, args.factor, REDUCTIONS[args.reduction], args.processes, memoryBudget=args.memory<<20)
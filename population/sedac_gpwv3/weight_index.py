@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+'''
+Precomputed cell to region weight index of a SEDAC GPW v3 grid
+
+For a given grid resolution (glbnds and pcount netCDF files) and region set (country -> region mapping)
+the index is a sparse [regions x valid cells] matrix of the population weights of the cells normalized
+to 1 in every region. Any co-registered gridded field can be reduced to population weighted regional
+means with a single sparse matrix - vector product.
+The index is cached on disk, the cache key is the hash of the input files and of the region mapping.
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import os
+import collections
+import numpy
+import scipy.sparse
+import hashing
+import grid_cache
+import sedac_nc
+import zonal
+
+# gridShape: shape of the (lat, lon) grid, cells: flat index of the valid cells in the grid,
+# weights: sparse [regions x cells] matrix of normalized weights, totals: total weight (e.g. population) of the regions
+WeightIndex = collections.namedtuple('WeightIndex', 'gridShape cells weights totals')
+
+# mean radius of the Earth in km
+EARTH_RADIUS = 6371.0
+
+def buildWeightIndex(glbnds, pcount, mapping, size):
+    # Creates the weight index from the glbnds and pcount grids, mapping assigns a region index to every country id
+    # (negative if the country doesn't belong to any region) and size is the number of regions
+    valid, regions = zonal.getZoneMask(glbnds, size, mapping, pcount)
+    cells = numpy.flatnonzero(valid)
+    population = numpy.ma.getdata(pcount)[valid].astype('float64')
+    totals = numpy.bincount(regions, weights=population, minlength=size)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        weights = numpy.where(0<totals[regions], population/totals[regions], 0.0)
+    matrix = scipy.sparse.csr_matrix((weights, (regions, numpy.arange(cells.size))), shape=(size, cells.size))
+    return WeightIndex(gridShape=glbnds.shape, cells=cells, weights=matrix, totals=totals)
+
+def getRowAreas(lats, gridSize=None):
+    # area of the cells of every row of a regular lat/lon grid in km2 (lats are the cell centers, the grid size is
+    # taken from them if it isn't given)
+    if gridSize is None: gridSize = abs(float(lats[1]-lats[0])) if 1<len(lats) else 180.0
+    lats = numpy.asarray(lats, dtype='float64')
+    return EARTH_RADIUS**2 * numpy.radians(gridSize) * (numpy.sin(numpy.radians(lats+gridSize/2)) - numpy.sin(numpy.radians(lats-gridSize/2)))
+
+def getAreaWeightIndex(index, lats):
+    # Creates an index with the same cells and regions, but with the normalized area of the cells as weights
+    # (the area of a regular lat/lon cell is proportional to the cosine of its latitude), totals are in km2
+    cellArea = getRowAreas(lats)
+    weights = index.weights.tocoo()
+    area = cellArea[index.cells[weights.col]//index.gridShape[1]]
+    totals = numpy.bincount(weights.row, weights=area, minlength=index.totals.size)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        normalized = numpy.where(0<totals[weights.row], area/totals[weights.row], 0.0)
+    matrix = scipy.sparse.csr_matrix((normalized, (weights.row, weights.col)), shape=weights.shape)
+    return WeightIndex(gridShape=index.gridShape, cells=index.cells, weights=matrix, totals=totals)
+
+def saveWeightIndex(index, npzFile):
+    numpy.savez_compressed(npzFile, gridShape=numpy.array(index.gridShape), cells=index.cells,
+                           data=index.weights.data, indices=index.weights.indices, indptr=index.weights.indptr,
+                           shape=numpy.array(index.weights.shape), totals=index.totals)
+
+def loadWeightIndex(npzFile):
+    with numpy.load(npzFile) as f:
+        weights = scipy.sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        return WeightIndex(gridShape=tuple(f['gridShape']), cells=f['cells'], weights=weights, totals=f['totals'])
+
+def getWeightIndex(glbndsFile, pcountFile, mapping, size, cacheDir=grid_cache.GRID_CACHE_DIR):
+    # Returns the weight index of the given grid files and region mapping, it's built only if it isn't in the cache yet
+    # (the index is stored in the grid cache folder, next to the cached grids)
+    key = hashing.combinedHash(hashing.fileHash(glbndsFile), hashing.fileHash(pcountFile), numpy.asarray(mapping), size)
+    npzFile = os.path.join(cacheDir, 'weights_'+key+'.npz')
+    if grid_cache.isCached(npzFile): return loadWeightIndex(npzFile)
+    glbnds, latsG, lonsG = grid_cache.openNcGrid(glbndsFile, 'glbnds', cacheDir)
+    pcount, latsP, lonsP = grid_cache.openNcGrid(pcountFile, 'pcount', cacheDir)
+    sedac_nc.checkSameGrid(latsG, lonsG, latsP, lonsP)
+    index = buildWeightIndex(glbnds, pcount, mapping, size)
+    grid_cache.saveAtomic(npzFile, lambda f: saveWeightIndex(index, f))
+    grid_cache.evict(cacheDir, keep=(npzFile,))
+    return index
+
+def gatherCells(index, field):
+    # Values of the cells of the index from a co-registered (lat, lon) field or a stack of fields (..., lat, lon):
+    # a [cells x fields] float64 array (masked cells are 0), and a [cells x fields] float64 array of the unmasked cells
+    # (None if no cell is masked), they can be reduced with any index of the same cells (see getAreaWeightIndex)
+    if field.shape[-2:]!=tuple(index.gridShape): raise Exception('Different grids!', 'Shape {0} instead of {1}.'.format(field.shape[-2:], index.gridShape))
+    gridSize = index.gridShape[0]*index.gridShape[1]
+    values = numpy.ma.getdata(field).reshape(-1, gridSize)[:,index.cells].T.astype('float64')
+    mask = numpy.ma.getmaskarray(field).reshape(-1, gridSize)[:,index.cells].T
+    if not mask.any(): return values, None
+    values[mask] = 0.0
+    return values, (~mask).astype('float64')
+
+def reduceCells(index, values, valid=None):
+    # [regions x fields] weighted means of the gathered values (see gatherCells) - if cells are masked, the weights of
+    # the remaining cells are renormalized in every region, regions without weights get nan
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        if valid is not None: return index.weights.dot(values) / index.weights.dot(valid)
+        means = index.weights.dot(values)
+        means[index.totals<=0,:] = numpy.nan
+    return means
+
+def regionalMeans(index, field):
+    # Population weighted regional means of a co-registered (lat, lon) field, or of a stack of fields (..., lat, lon),
+    # with one sparse matrix product - if the field has masked cells, the weights of the remaining cells are
+    # renormalized in every region, regions without weights get nan
+    means = reduceCells(index, *gatherCells(index, field))
+    return means.T.reshape(field.shape[:-2]+(index.totals.size,))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+'''
+Vectorized zonal statistics over the SEDAC GPW v3 grids
+
+The valid cells of an id grid (e.g. glbnds) are flattened, mapped to zones (countries or regions)
+and every statistic is calculated in one pass with numpy.bincount (sums, counts, means) or on the
+cells sorted by zone with ufunc.reduceat (min, max).
+
+Code is written and tested under Python 2.7
+
+@license: This work is licensed under a Creative Commons Attribution 4.0 International License (http://creativecommons.org/licenses/by/4.0/)
+@author: Mate Rozsai
+'''
+import collections
+import numpy
+
+ZonalStats = collections.namedtuple('ZonalStats', 'count sum mean min max weightedMean')
+
+def getZoneMask(ids, size, mapping=None, *variables):
+    # Returns the grid of valid cells and the zone index of the valid cells (in C order)
+    # a cell is valid if it isn't masked in any of the grids and its zone is in [0, size)
+    # mapping is an optional array that assigns a zone to every id (negative if the id doesn't belong to any zone)
+    for var in variables:
+        if var.shape!=ids.shape: raise Exception('Different grids!', 'Shape {0} instead of {1}.'.format(var.shape, ids.shape))
+    valid = ~numpy.ma.getmaskarray(ids)
+    for var in variables: valid &= ~numpy.ma.getmaskarray(var)
+    zones = numpy.ma.getdata(ids)[valid]
+    if mapping is not None:
+        mapped = (0<=zones) & (zones<mapping.size)
+        zones = numpy.where(mapped, mapping[numpy.where(mapped, zones, 0)], -1)
+    inZone = (0<=zones) & (zones<size)
+    if not inZone.all():
+        valid[valid] = inZone
+        zones = zones[inZone]
+    return valid, zones
+
+def getZoneCells(ids, size, mapping=None, *variables):
+    # Returns the zone index of the valid cells and the corresponding values of the co-registered variables
+    valid, zones = getZoneMask(ids, size, mapping, *variables)
+    return (zones,) + tuple(numpy.ma.getdata(var)[valid] for var in variables)
+
+def zonalSums(ids, values, size, mapping=None):
+    # Sum of the values in every zone (e.g. total population of the countries or regions)
+    zones, values = getZoneCells(ids, size, mapping, values)
+    return numpy.bincount(zones, weights=values, minlength=size)
+
+def zonalStatistics(ids, values, size, mapping=None, weights=None):
+    # Count, sum, mean, min and max of the values in every zone, and if weights are given (e.g. population)
+    # the weighted mean of the values - statistics of empty zones are nan (count and sums are 0)
+    if weights is None: zones, values = getZoneCells(ids, size, mapping, values)
+    else: zones, values, weights = getZoneCells(ids, size, mapping, values, weights)
+    count = numpy.bincount(zones, minlength=size)
+    total = numpy.bincount(zones, weights=values, minlength=size)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mean = total/count
+        weightedMean = None
+        if weights is not None:
+            weightedMean = numpy.bincount(zones, weights=values*weights, minlength=size) / numpy.bincount(zones, weights=weights, minlength=size)
+    # min and max on the cells sorted by zone
+    minimum = numpy.empty([size]); minimum[:] = numpy.nan
+    maximum = numpy.empty([size]); maximum[:] = numpy.nan
+    if zones.size:
+        order = numpy.argsort(zones, kind='mergesort')
+        nonEmpty = numpy.nonzero(count)[0]
+        starts = numpy.searchsorted(zones[order], nonEmpty)
+        sortedValues = values[order]
+        minimum[nonEmpty] = numpy.minimum.reduceat(sortedValues, starts)
+        maximum[nonEmpty] = numpy.maximum.reduceat(sortedValues, starts)
+    return ZonalStats(count=count, sum=total, mean=mean, min=minimum, max=maximum, weightedMean=weightedMean)